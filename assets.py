@@ -0,0 +1,117 @@
+import csv
+import os
+
+# Asset hierarchy from structure.txt: enterprise/site/area/work_centre/machine.
+#
+# Sequences run on a work centre (a unit in site_run_detail) and steps run on a
+# machine. ASSET_FILE (optional) lists the known assets, one row each, with columns
+# enterprise, site, area, work_centre and, optionally, machine. Units that are not
+# listed are placed under ENTERPRISE/<site>/UNASSIGNED_AREA/<unit>.
+#
+# Every node keeps rollups of the steps running on it and below it. A step state
+# change only updates the step's machine and its ancestors, so a query at any level
+# is a dictionary lookup.
+ASSET_FILE = os.getenv("ASSET_FILE", "assets.csv")
+ENTERPRISE = os.getenv("ENTERPRISE", "enterprise")
+UNASSIGNED_AREA = os.getenv("UNASSIGNED_AREA", "unassigned")
+
+LEVELS = ("enterprise", "site", "area", "work_centre", "machine")
+
+
+class AssetNode:
+    """One asset and the rollups of every step on it or below it"""
+    __slots__ = (
+        "path", "name", "level", "parent", "children",
+        "running", "idle", "completed", "active_time", "idle_time", "performance_total",
+    )
+
+    def __init__(self, path, name, level, parent=None):
+        self.path = path
+        self.name = name
+        self.level = level
+        self.parent = parent
+        self.children = {}
+        self.running = 0           # Steps RUNNING now
+        self.idle = 0              # Steps IDLE now
+        self.completed = 0         # Steps completed (skipped steps are not counted)
+        self.active_time = 0.0     # Of completed steps, seconds
+        self.idle_time = 0.0       # Of completed steps, seconds
+        self.performance_total = 0.0
+
+    def transition(self, old, new, step):
+        """Apply a step's change from state name old to new here and on every ancestor"""
+        if old == "PENDING" and new == "COMPLETE":
+            return  # Skipped without ever starting
+        running = (new == "RUNNING") - (old == "RUNNING")
+        idle = (new == "IDLE") - (old == "IDLE")
+        completed = new == "COMPLETE"
+        if completed:
+            active_time, idle_time, performance = step.active_time, step.idle_time, step.processing_performance
+
+        node = self
+        while node is not None:
+            node.running += running
+            node.idle += idle
+            if completed:
+                node.completed += 1
+                node.active_time += active_time
+                node.idle_time += idle_time
+                node.performance_total += performance
+            node = node.parent
+
+    def status(self):
+        return {
+            "path": self.path,
+            "level": LEVELS[self.level],
+            "running": self.running,
+            "idle": self.idle,
+            "completed": self.completed,
+            "active_time": self.active_time,
+            "idle_time": self.idle_time,
+            "average_performance": self.performance_total / self.completed if self.completed else None,
+        }
+
+
+class AssetTree:
+    """Asset nodes indexed by path, e.g. "enterprise/site1/area1/unit1/mixer" """
+    def __init__(self, path=ASSET_FILE):
+        self.nodes = {}
+        self.work_centres = {}  # (site, unit) -> work centre node
+        if path and os.path.exists(path):
+            with open(path, newline="") as f:
+                for row in csv.DictReader(f):
+                    names = [row.get(level) or "" for level in LEVELS]
+                    node = self.add(names if names[-1] else names[:-1])
+                    work_centre = node if node.level == 3 else node.parent
+                    self.work_centres.setdefault((names[1], names[3]), work_centre)
+
+    def add(self, names):
+        """Node for a list of names from the enterprise down, created with its ancestors if missing"""
+        node = None
+        path = ""
+        for level, name in enumerate(names):
+            path = f"{path}/{name}" if path else name
+            child = self.nodes.get(path)
+            if child is None:
+                child = self.nodes[path] = AssetNode(path, name, level, node)
+                if node is not None:
+                    node.children[name] = child
+            node = child
+        return node
+
+    def get(self, path):
+        return self.nodes.get(path)
+
+    def locate(self, site, unit, machine=None):
+        """Node a step of a batch on (site, unit) runs on: its machine, else the work centre"""
+        work_centre = self.work_centres.get((site, unit))
+        if work_centre is None:
+            work_centre = self.work_centres[(site, unit)] = self.add([ENTERPRISE, str(site), UNASSIGNED_AREA, str(unit)])
+        if not machine:
+            return work_centre
+        return work_centre.children.get(machine) or self.add(work_centre.path.split("/") + [machine])
+
+    def status(self, path):
+        """Rollups of one asset, or None if there is no such asset"""
+        node = self.nodes.get(path)
+        return None if node is None else node.status()
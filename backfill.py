@@ -0,0 +1,199 @@
+import argparse
+import re
+import time
+from array import array
+from datetime import datetime
+
+import numpy as np
+import psycopg2
+
+import codec
+import fetcher
+
+# Bulk export of site_run_detail history into a local columnar file, and replay of
+# that file into operation_queue. Used to tune batch_routing.csv durations and to
+# load-test the engine without going through the live poller.
+#
+# File layout (numpy .npz, compressed):
+#   id, start_time           int64 columns, start_time as epoch seconds
+#   site, unit, batch_id, step
+#                            int32 codes into the matching <column>_values array
+
+STRING_COLUMNS = ("site", "unit", "batch_id", "step")
+
+# Backslash escapes used by COPY text format
+COPY_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f", "v": "\v"}
+COPY_ESCAPE_PATTERN = re.compile(r"\\(.)")
+
+
+class ColumnWriter:
+    """File-like sink for COPY ... TO STDOUT that parses rows straight into columns.
+
+    COPY text format puts one row per line with tab-separated fields, so rows are
+    split as the chunks arrive and only the column arrays are kept in memory.
+    """
+    def __init__(self):
+        self.ids = array("q")
+        self.start_times = array("q")
+        self.codes = {column: array("i") for column in STRING_COLUMNS}
+        self.values = {column: {} for column in STRING_COLUMNS}
+        self.partial = ""
+
+    def write(self, data):
+        if isinstance(data, bytes):
+            data = data.decode()
+        lines = (self.partial + data).split("\n")
+        self.partial = lines.pop()
+        for line in lines:
+            self.add_row(line.split("\t"))
+
+    def add_row(self, fields):
+        record_id, site, unit, batch_id, step, start_time = fields
+        self.ids.append(int(record_id))
+        self.start_times.append(int(start_time))
+        for column, value in zip(STRING_COLUMNS, (site, unit, batch_id, step)):
+            if value == "\\N":
+                value = ""
+            elif "\\" in value:
+                value = COPY_ESCAPE_PATTERN.sub(lambda match: COPY_ESCAPES.get(match.group(1), match.group(1)), value)
+            self.codes[column].append(self.values[column].setdefault(value, len(self.values[column])))
+
+    def save(self, path):
+        columns = {
+            "id": np.frombuffer(self.ids, dtype=np.int64),
+            "start_time": np.frombuffer(self.start_times, dtype=np.int64),
+        }
+        for column in STRING_COLUMNS:
+            columns[column] = np.frombuffer(self.codes[column], dtype=np.int32)
+            columns[f"{column}_values"] = np.array(list(self.values[column]), dtype=str)
+        np.savez_compressed(path, **columns)
+
+
+# Function to export an ID or time range of site_run_detail into a columnar file
+def export_history(path, from_id=None, to_id=None, since=None, until=None, all_units=False):
+    conditions = []
+    params = []
+    if from_id is not None:
+        conditions.append("id >= %s")
+        params.append(from_id)
+    if to_id is not None:
+        conditions.append("id <= %s")
+        params.append(to_id)
+    if since is not None:
+        conditions.append("start_time >= %s")
+        params.append(since)
+    if until is not None:
+        conditions.append("start_time < %s")
+        params.append(until)
+    if not all_units:
+        conditions.append("(site, unit) IN (SELECT * FROM unnest(%s::text[], %s::text[]))")
+        params.extend([fetcher.WATCHED_SITES, fetcher.WATCHED_UNIT_NAMES])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    connection = psycopg2.connect(
+        host=fetcher.DB_HOST,
+        port=fetcher.DB_PORT,
+        database=fetcher.DB_NAME,
+        user=fetcher.DB_USER,
+        password=fetcher.DB_PASSWORD
+    )
+    try:
+        with connection.cursor() as cursor:
+            query = cursor.mogrify(f"""
+            SELECT id, site, unit, batch_id, step, extract(epoch FROM start_time)::bigint
+            FROM {fetcher.TABLE_NAME}
+            {where}
+            ORDER BY id ASC
+            """, params).decode()
+            writer = ColumnWriter()
+            started = time.monotonic()
+            cursor.copy_expert(f"COPY ({query}) TO STDOUT", writer)
+        connection.rollback()
+    finally:
+        connection.close()
+
+    writer.save(path)
+    print(f"Exported {len(writer.ids)} records to {path} in {time.monotonic() - started:.2f} seconds.")
+
+# Function to load an exported file back into plain columns
+def load_history(path):
+    with np.load(path) as data:
+        columns = {"id": data["id"].tolist(), "start_time": data["start_time"].tolist()}
+        for column in STRING_COLUMNS:
+            columns[column] = data[f"{column}_values"][data[column]].tolist()
+    return columns
+
+# Function to replay an exported file into Redis.
+# Records are pushed in ID order, so ordering per unit is preserved. With speed > 0
+# each record is released when (its start_time - the first start_time) / speed has
+# passed; with speed 0 the file is pushed as fast as Redis takes it.
+def replay_history(path, speed=0.0):
+    columns = load_history(path)
+    count = len(columns["id"])
+    if not count:
+        print(f"No records in {path}.")
+        return
+
+    # Release schedule in seconds of history. Running maximum, so a start_time that
+    # goes backwards never holds back the records after it.
+    start_times = np.asarray(columns["start_time"])
+    schedule = np.maximum.accumulate(start_times - start_times[0])
+    unit_keys = {}
+    started = time.monotonic()
+    position = 0
+
+    while position < count:
+        if speed > 0:
+            history_now = (time.monotonic() - started) * speed
+            end = min(int(np.searchsorted(schedule, history_now, side="right")), position + fetcher.REDIS_CHUNK_SIZE)
+            if end == position:
+                time.sleep((schedule[position] - history_now) / speed)
+                continue
+        else:
+            end = min(position + fetcher.REDIS_CHUNK_SIZE, count)
+
+        messages = {}
+        for i in range(position, end):
+            site, unit = columns["site"][i], columns["unit"][i]
+            key = unit_keys.get((site, unit))
+            if key is None:
+                key = unit_keys[(site, unit)] = fetcher.REDIS_LIST_NAME.format(site=site, unit=unit)
+            messages.setdefault(key, []).append(codec.encode(
+                columns["id"][i],
+                site,
+                unit,
+                columns["batch_id"][i] or None,
+                columns["step"][i],
+                columns["start_time"][i],
+            ))
+        if not fetcher.push_to_redis(messages, {}):
+            print(f"Stopping replay at record ID {columns['id'][position]}.")
+            return
+        position = end
+
+    elapsed = time.monotonic() - started
+    print(f"Replayed {count} records in {elapsed:.2f} seconds ({count / max(elapsed, 1e-9):.0f} records/s).")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export and replay site_run_detail history.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="bulk-export a range of site_run_detail to a .npz file")
+    export_parser.add_argument("output", help="file to write, e.g. history.npz")
+    export_parser.add_argument("--from-id", type=int, help="first record ID to export")
+    export_parser.add_argument("--to-id", type=int, help="last record ID to export")
+    export_parser.add_argument("--since", type=datetime.fromisoformat, help="export records starting at or after this time")
+    export_parser.add_argument("--until", type=datetime.fromisoformat, help="export records starting before this time")
+    export_parser.add_argument("--all-units", action="store_true", help="export every unit, not just UNITS")
+
+    replay_parser = commands.add_parser("replay", help="feed an exported file into operation_queue")
+    replay_parser.add_argument("input", help="file written by export")
+    replay_parser.add_argument("--speed", type=float, default=0.0,
+                               help="multiple of real time, e.g. 60 replays an hour per minute (0 = as fast as possible)")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        export_history(args.output, args.from_id, args.to_id, args.since, args.until, args.all_units)
+    else:
+        replay_history(args.input, args.speed)
@@ -0,0 +1,47 @@
+import os
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+# Clocks for the step engines. Event start_time values are naive DCS timestamps,
+# so every clock returns naive datetimes in the DCS time zone.
+#   "wall"  - live runs: the current time in DCS_TIMEZONE.
+#   "event" - replay: the latest start_time seen. Time only moves when events
+#             arrive, so history is re-run as fast as the engine can read it.
+CLOCK = os.getenv("CLOCK", "wall")
+DCS_TIMEZONE = os.getenv("DCS_TIMEZONE", "UTC")  # Zone the DCS writes start_time in
+
+
+class WallClock:
+    """Current time in the DCS time zone"""
+    realtime = True
+
+    def __init__(self, timezone=DCS_TIMEZONE):
+        self.zone = ZoneInfo(timezone)
+
+    def now(self):
+        return datetime.now(self.zone).replace(tzinfo=None)
+
+    def advance(self, event_time):
+        pass  # Wall time moves by itself
+
+
+class EventClock:
+    """Time driven by event timestamps. None until the first event; never goes backwards."""
+    realtime = False
+
+    def __init__(self, start=None):
+        self.current = start
+
+    def now(self):
+        return self.current
+
+    def advance(self, event_time):
+        if self.current is None or event_time > self.current:
+            self.current = event_time
+
+
+# Function to create the configured clock
+def make_clock(kind=CLOCK):
+    if kind == "event":
+        return EventClock()
+    return WallClock()
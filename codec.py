@@ -0,0 +1,175 @@
+import json
+import os
+import struct
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+# Shared codec for step events on operation_queue.
+#
+# Two encodings, told apart by the first byte, so consumers decode either:
+#   JSON   - {"id", "site", "unit", "batch_id", "step", "start_time": "%Y-%m-%d %H:%M:%S"}
+#            Human readable, kept for debugging and older consumers. Always starts with "{".
+#   binary - version byte, then a fixed header and length-prefixed strings:
+#              <B  version (CODEC_VERSION)
+#              <q  start_time, epoch seconds (naive DCS time taken as UTC)
+#              <q  record id, -1 when unknown
+#              then site, unit, batch_id, step, each as <H byte length + UTF-8
+#              (batch_id length 0xFFFF means None)
+#
+# batch_id is always decoded as a string (or None) whichever the encoding and
+# whatever type the producer passed, since engines key batches by it.
+# Producers pick the encoding with MESSAGE_CODEC ("json" or "binary").
+MESSAGE_CODEC = os.getenv("MESSAGE_CODEC", "json")
+CODEC_VERSION = 1
+
+HEADER = struct.Struct("<Bqq")
+HEADER_DTYPE = np.dtype([("version", "u1"), ("start_time", "<i8"), ("id", "<i8")])
+STRING_LENGTH = struct.Struct("<H")
+NO_BATCH = 0xFFFF
+MAX_CACHE = 65536  # Entries kept in each string cache before it is reset
+
+EPOCH = datetime(1970, 1, 1)
+ONE_SECOND = timedelta(seconds=1)
+
+# start_time is epoch seconds
+StepEvent = namedtuple("StepEvent", "id site unit batch_id step start_time")
+# Column-wise batch of events; id and start_time are int64 arrays, the rest lists
+StepEventColumns = namedtuple("StepEventColumns", "id site unit batch_id step start_time")
+
+encode_json = json.JSONEncoder(separators=(",", ":")).encode
+
+# (site, unit, batch_id, step) -> encoded string section, and the reverse.
+# Events of one unit repeat the same few strings, so each section is built and
+# decoded once and the decoded strings are shared (interned) by every event.
+_encoded_strings = {}
+_decoded_strings = {}
+
+
+# Function to convert a datetime to epoch seconds. Aware values (timestamptz
+# columns) are converted to UTC first; naive ones are taken as they are.
+def to_epoch(value):
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return (value - EPOCH) // ONE_SECOND
+
+# Function to convert epoch seconds back to a naive datetime
+def to_datetime(epoch):
+    return EPOCH + timedelta(seconds=int(epoch))
+
+# Function to convert an array of epoch seconds to naive datetimes in one call
+def to_datetimes(epochs):
+    return np.asarray(epochs, dtype="datetime64[s]").tolist()
+
+# Function to encode one step event in the given codec
+def encode(record_id, site, unit, batch_id, step, start_time, codec=MESSAGE_CODEC):
+    if codec == "binary":
+        strings = _encoded_strings.get((site, unit, batch_id, step))
+        if strings is None:
+            if len(_encoded_strings) >= MAX_CACHE:
+                _encoded_strings.clear()
+            strings = b"".join(_encode_string(value) for value in (site, unit, batch_id, step))
+            _encoded_strings[(site, unit, batch_id, step)] = strings
+        return HEADER.pack(CODEC_VERSION, start_time, -1 if record_id is None else record_id) + strings
+
+    return encode_json({
+        "id": record_id,
+        "site": site,
+        "unit": unit,
+        "batch_id": _batch_id(batch_id),
+        "step": step,
+        "start_time": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(start_time)),
+    })
+
+def _batch_id(value):
+    return None if value is None else str(value)
+
+def _encode_string(value):
+    if value is None:
+        return STRING_LENGTH.pack(NO_BATCH)
+    encoded = str(value).encode()
+    return STRING_LENGTH.pack(len(encoded)) + encoded
+
+# Function to decode the strings section of a binary event, through the cache
+def _decode_strings(section):
+    strings = _decoded_strings.get(section)
+    if strings is None:
+        if len(_decoded_strings) >= MAX_CACHE:
+            _decoded_strings.clear()
+        values = []
+        position = 0
+        for _ in range(4):
+            (length,) = STRING_LENGTH.unpack_from(section, position)
+            position += STRING_LENGTH.size
+            if length == NO_BATCH:
+                values.append(None)
+            else:
+                values.append(section[position:position + length].decode())
+                position += length
+        strings = _decoded_strings[section] = tuple(values)
+    return strings
+
+# Function to tell the encodings apart. Anything but a JSON object is taken as
+# binary, so a payload of another codec version fails the version check.
+def _is_binary(payload):
+    return isinstance(payload, bytes) and payload[:1] != b"{"
+
+# Function to decode one JSON event
+def _decode_json(payload):
+    record = json.loads(payload)
+    return StepEvent(
+        record.get("id"),
+        record.get("site"),
+        record.get("unit"),
+        _batch_id(record.get("batch_id")),
+        record["step"],
+        to_epoch(datetime.fromisoformat(record["start_time"])),
+    )
+
+# Function to decode one event in either encoding
+def decode(payload):
+    if not _is_binary(payload):
+        return _decode_json(payload)
+
+    version, start_time, record_id = HEADER.unpack_from(payload)
+    if version != CODEC_VERSION:
+        raise ValueError(f"Unsupported step event codec version {version}")
+    site, unit, batch_id, step = _decode_strings(payload[HEADER.size:])
+    return StepEvent(None if record_id == -1 else record_id, site, unit, batch_id, step, start_time)
+
+# Function to decode a batch of events into columns.
+# The fixed headers of binary events are decoded with a single numpy call, and each
+# distinct strings section is decoded once. JSON events fall back to decode().
+def decode_many(payloads):
+    count = len(payloads)
+    ids = np.full(count, -1, dtype=np.int64)
+    start_times = np.zeros(count, dtype=np.int64)
+    sites = [None] * count
+    units = [None] * count
+    batch_ids = [None] * count
+    steps = [None] * count
+
+    binary = [i for i, payload in enumerate(payloads) if _is_binary(payload)]
+    if binary:
+        if any(len(payloads[i]) < HEADER.size for i in binary):
+            raise ValueError("Truncated step event")
+        headers = np.frombuffer(b"".join(payloads[i][:HEADER.size] for i in binary), dtype=HEADER_DTYPE)
+        if (headers["version"] != CODEC_VERSION).any():
+            raise ValueError(f"Unsupported step event codec version {set(headers['version'].tolist())}")
+        ids[binary] = headers["id"]
+        start_times[binary] = headers["start_time"]
+        for i in binary:
+            sites[i], units[i], batch_ids[i], steps[i] = _decode_strings(payloads[i][HEADER.size:])
+
+    if len(binary) < count:
+        binary = set(binary)
+        for i, payload in enumerate(payloads):
+            if i not in binary:
+                event = _decode_json(payload)
+                ids[i] = -1 if event.id is None else event.id
+                start_times[i] = event.start_time
+                sites[i], units[i], batch_ids[i], steps[i] = event.site, event.unit, event.batch_id, event.step
+
+    return StepEventColumns(ids, sites, units, batch_ids, steps, start_times)
@@ -0,0 +1,99 @@
+import os
+
+# Topic dispatcher for machine messages (structure.txt):
+#   {"topic": "enterprise/site/area/work_centre/machine",
+#    "payload": {"timestamp": ..., "parameter": ..., "value": ...}}
+#
+# Subscriptions are topic filters with MQTT wildcards: "+" matches exactly one
+# level, "#" (last level only) matches any number of levels, including none.
+# Filters are stored in a trie, so matching a topic walks at most a few branches
+# per level whatever the number of subscriptions, and the result for each topic
+# is cached until the subscriptions change.
+DISPATCH_CACHE_SIZE = int(os.getenv("DISPATCH_CACHE_SIZE", 100000))  # Topics cached before the cache is reset
+
+
+class TrieNode:
+    __slots__ = ("children", "handlers")
+
+    def __init__(self):
+        self.children = {}  # Level -> TrieNode, including "+" and "#"
+        self.handlers = []
+
+
+class Dispatcher:
+    """Hands each message to the handlers whose filter matches its topic"""
+    def __init__(self, cache_size=DISPATCH_CACHE_SIZE):
+        self.root = TrieNode()
+        self.cache = {}  # Topic -> tuple of matching handlers
+        self.cache_size = cache_size
+
+    def subscribe(self, topic_filter, handler):
+        """Call handler(topic, payload) for every message whose topic matches topic_filter"""
+        levels = topic_filter.split("/")
+        for i, level in enumerate(levels):
+            if ("#" in level and (level != "#" or i != len(levels) - 1)) or ("+" in level and level != "+"):
+                raise ValueError(f"Invalid topic filter {topic_filter!r}")
+        node = self.root
+        for level in levels:
+            child = node.children.get(level)
+            if child is None:
+                child = node.children[level] = TrieNode()
+            node = child
+        node.handlers.append(handler)
+        self.cache.clear()
+
+    def unsubscribe(self, topic_filter, handler):
+        levels = topic_filter.split("/")
+        path = [self.root]
+        for level in levels:
+            node = path[-1].children.get(level)
+            if node is None:
+                return
+            path.append(node)
+        if handler not in path[-1].handlers:
+            return
+        path[-1].handlers.remove(handler)
+        self.cache.clear()
+
+        # Drop the branch if nothing is left below it
+        for i in range(len(levels), 0, -1):
+            if path[i].handlers or path[i].children:
+                break
+            del path[i - 1].children[levels[i - 1]]
+
+    def match(self, topic):
+        """Handlers subscribed to topic, each once, in subscription-trie order"""
+        handlers = self.cache.get(topic)
+        if handlers is not None:
+            return handlers
+
+        levels = topic.split("/")
+        found = []
+        stack = [(self.root, 0)]
+        while stack:
+            node, i = stack.pop()
+            # Topics starting with "$" are only matched explicitly at the first level
+            wildcards = i > 0 or not levels[0].startswith("$")
+            if wildcards and "#" in node.children:
+                found.extend(node.children["#"].handlers)
+            if i == len(levels):
+                found.extend(node.handlers)
+                continue
+            child = node.children.get(levels[i])
+            if child is not None:
+                stack.append((child, i + 1))
+            if wildcards and "+" in node.children:
+                stack.append((node.children["+"], i + 1))
+
+        handlers = tuple(dict.fromkeys(found))
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        self.cache[topic] = handlers
+        return handlers
+
+    def dispatch(self, topic, payload):
+        """Hands payload to every matching handler. Returns how many there were."""
+        handlers = self.match(topic)
+        for handler in handlers:
+            handler(topic, payload)
+        return len(handlers)
@@ -0,0 +1,94 @@
+import atexit
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Shared log pipeline for the step engines.
+#
+# Loggers only put records on an in-memory queue; a QueueListener thread formats
+# them as JSON lines and writes them to LOG_FILE. The file rotates at LOG_MAX_BYTES
+# and rotated files are gzipped, keeping LOG_BACKUPS of them. Levels are set per
+# logger with LOG_LEVELS, e.g. "ProductionLogger=DEBUG,fetcher=WARNING".
+LOG_FILE = os.getenv("LOG_FILE", "logfile.log")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024))
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", 10))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")  # Level of loggers not named in LOG_LEVELS
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+
+# Attributes every LogRecord has; anything else was passed with extra= and is logged as a field
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and any extra= fields"""
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in RECORD_ATTRIBUTES:
+                entry[name] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread.
+
+    The stock prepare() merges the message arguments on the caller's thread. Here
+    the record is queued as it is, so arguments must not be mutated after logging.
+    """
+    def prepare(self, record):
+        return record
+
+
+# Function to gzip a rotated log file
+def gzip_rotator(source, dest):
+    with open(source, "rb") as log_file, gzip.open(dest, "wb") as compressed:
+        shutil.copyfileobj(log_file, compressed)
+    os.remove(source)
+
+# Function to name rotated log files, e.g. logfile.log.1.gz
+def gzip_namer(name):
+    return f"{name}.gz"
+
+
+# Function to route every logger through the queue and start the writer thread.
+# Safe to call more than once; only the first call sets anything up.
+def setup_logging():
+    global _listener
+    if _listener is not None:
+        return
+
+    file_handler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS)
+    file_handler.rotator = gzip_rotator
+    file_handler.namer = gzip_namer
+    file_handler.setFormatter(JsonFormatter())
+
+    log_queue = queue.SimpleQueue()  # Unbounded, so logging never blocks the caller
+    root = logging.getLogger()
+    root.addHandler(DeferredQueueHandler(log_queue))
+    root.setLevel(LOG_LEVEL.upper())
+    for setting in filter(None, LOG_LEVELS.split(",")):
+        name, _, level = setting.partition("=")
+        logging.getLogger(name.strip()).setLevel(level.strip().upper())
+
+    _listener = QueueListener(log_queue, file_handler)
+    _listener.start()
+    atexit.register(_listener.stop)  # Flush what is still queued on exit
+
+
+# Function to get a logger that writes through the shared pipeline
+def get_logger(name):
+    setup_logging()
+    return logging.getLogger(name)
@@ -1,11 +1,19 @@
 import psycopg2
-import pandas as pd
+import psycopg2.extensions
+import psycopg2.pool
+from psycopg2 import sql
+import argparse
+import select
 import time
 import json
+import random
 import redis
 from dotenv import load_dotenv
 import os
-from datetime import datetime
+from itertools import islice
+
+import codec
+import transport
 
 # Load environment variables
 load_dotenv()
@@ -19,149 +27,578 @@ DB_PASSWORD = os.getenv("DB_PASSWORD")
 TABLE_NAME = os.getenv("TABLE_NAME")
 PLANT_FILTER = os.getenv("PLANT_FILTER")  # Filter for plant (e.g., "PlantA")
 UNIT_FILTER = os.getenv("UNIT_FILTER")    # Filter for unit (e.g., "Unit1")
-POLL_INTERVAL = int(os.getenv("POLL_INTERVAL", 10))  # Default to 10 seconds if not set
+# Watched (site, unit) pairs, e.g. "PlantA:Unit1,PlantA:Unit2". Defaults to PLANT_FILTER/UNIT_FILTER.
+UNITS = os.getenv("UNITS", f"{PLANT_FILTER}:{UNIT_FILTER}")
+POLL_INTERVAL = float(os.getenv("POLL_INTERVAL", 10))  # Default to 10 seconds if not set, sub-second values allowed
+# Adaptive polling bounds. A unit's interval shrinks while rows arrive and grows while it is quiet.
+# Both default to POLL_INTERVAL, which keeps the interval fixed.
+POLL_INTERVAL_MIN = float(os.getenv("POLL_INTERVAL_MIN", POLL_INTERVAL))
+POLL_INTERVAL_MAX = float(os.getenv("POLL_INTERVAL_MAX", POLL_INTERVAL))
+POLL_BACKOFF = float(os.getenv("POLL_BACKOFF", 2))  # Factor the interval is divided or multiplied by after each poll
+POLL_JITTER = float(os.getenv("POLL_JITTER", 0.1))  # +/- fraction of randomness, so quiet units drift apart
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))  # Connections opened up front and kept alive
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 4))
+FETCH_SIZE = int(os.getenv("FETCH_SIZE", 5000))  # Rows per page, bounds memory however far behind we are
+FETCH_MODE = os.getenv("FETCH_MODE", "poll")  # "poll" or "notify" (LISTEN/NOTIFY change feed)
+# Channel name, case preserved (LISTEN quotes it). Defaults to "<TABLE_NAME>_insert".
+NOTIFY_CHANNEL = os.getenv("NOTIFY_CHANNEL") or (f"{TABLE_NAME}_insert" if TABLE_NAME else None)
+NOTIFY_COALESCE = float(os.getenv("NOTIFY_COALESCE", 0.05))  # Seconds to gather a burst of notifications into one fetch
+NOTIFY_FALLBACK_INTERVAL = float(os.getenv("NOTIFY_FALLBACK_INTERVAL", 60))  # Catch-up poll when no notification arrives
 
 # Redis Configuration
 REDIS_HOST = "localhost"
 REDIS_PORT = 6379
 REDIS_DECODE_RESPONSES = True
-REDIS_LIST_NAME = "operation_queue"
+# List (or stream) each row is pushed to. May contain {site} and {unit} to give every unit its own list,
+# e.g. "operation_queue:{site}:{unit}". Messages carry site, unit and batch_id either way.
+REDIS_LIST_NAME = os.getenv("REDIS_LIST_NAME", "operation_queue")
+REDIS_CHUNK_SIZE = int(os.getenv("REDIS_CHUNK_SIZE", 1000))  # Max values per LPUSH command
+QUIET = os.getenv("QUIET", "false").lower() in ("1", "true", "yes")  # Drop the per-record prints
+
+# Offset checkpoints, so a restart resumes where the last run stopped instead of re-pushing the batch
+CHECKPOINT_BACKEND = os.getenv("CHECKPOINT_BACKEND", "redis")  # "redis", "file" or "none"
+CHECKPOINT_KEY = os.getenv("CHECKPOINT_KEY", "fetcher:offsets")  # Redis hash of "site/unit" -> last ID
+CHECKPOINT_FILE = os.getenv("CHECKPOINT_FILE", "fetcher_offsets.json")
+POLL_INTERVAL_KEY = os.getenv("POLL_INTERVAL_KEY", "fetcher:poll_interval")  # Redis hash of "site/unit" -> current interval
 
 # Initialize Redis client
 r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=REDIS_DECODE_RESPONSES)
 
-# Function to fetch the current batch records for the filtered plant and unit
-def get_current_batch_records():
-    try:
-        connection = psycopg2.connect(
+# Function to parse the UNITS setting into a tuple of (site, unit) pairs
+def parse_units(units):
+    pairs = []
+    for pair in units.split(","):
+        site, _, unit = pair.strip().partition(":")
+        if site and unit and (site, unit) not in pairs:
+            pairs.append((site, unit))
+    return tuple(pairs)
+
+WATCHED_UNITS = parse_units(UNITS)
+# Site and unit columns passed as arrays to the fan-out queries, built once
+WATCHED_SITES = [site for site, _ in WATCHED_UNITS]
+WATCHED_UNIT_NAMES = [unit for _, unit in WATCHED_UNITS]
+# Redis list for every watched unit, resolved once instead of per row
+UNIT_KEYS = {(site, unit): REDIS_LIST_NAME.format(site=site, unit=unit) for site, unit in WATCHED_UNITS}
+
+# All records of the latest batch of every watched unit. Run once at startup
+# through a server-side cursor, so a huge batch streams in constant memory.
+BATCH_RECORDS_QUERY = f"""
+        SELECT detail.id, detail.site, detail.unit, detail.batch_id, detail.step, detail.start_time
+        FROM unnest(%s::text[], %s::text[]) AS watched(site, unit)
+        CROSS JOIN LATERAL (
+            SELECT batch_id
+            FROM {TABLE_NAME}
+            WHERE site = watched.site AND unit = watched.unit
+            ORDER BY id DESC
+            LIMIT 1
+        ) AS latest
+        JOIN {TABLE_NAME} AS detail
+          ON detail.site = watched.site
+         AND detail.unit = watched.unit
+         AND detail.batch_id = latest.batch_id
+        ORDER BY detail.id ASC
+"""
+
+# Queries run on every poll. They are prepared once per connection and then
+# executed by name, so the server skips parsing and planning on each poll.
+PREPARED_STATEMENTS = {
+    # One page of records of every watched unit since the last ID, as a single range query
+    "new_records": f"""
+        SELECT id, site, unit, batch_id, step, start_time
+        FROM {TABLE_NAME}
+        WHERE id > $1
+          AND (site, unit) IN (SELECT * FROM unnest($2::text[], $3::text[]))
+        ORDER BY id ASC
+        LIMIT $4
+    """,
+    # Highest ID so far, where units without a checkpoint or rows start from
+    "max_id": f"SELECT COALESCE(MAX(id), 0) FROM {TABLE_NAME}",
+}
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """Long-lived connection that remembers which statements it has prepared"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.autocommit = True  # Polls are single reads, never leave the session idle in a transaction
+        self.prepared = set()
+
+
+_pool = None
+
+# Function to get (and lazily create) the shared connection pool
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = psycopg2.pool.ThreadedConnectionPool(
+            DB_POOL_MIN,
+            DB_POOL_MAX,
             host=DB_HOST,
             port=DB_PORT,
             database=DB_NAME,
             user=DB_USER,
-            password=DB_PASSWORD
+            password=DB_PASSWORD,
+            application_name="mfg-fetcher",
+            connection_factory=PooledConnection,
+            # TCP keepalives so dead connections are detected while the pool is idle
+            keepalives=1,
+            keepalives_idle=30,
+            keepalives_interval=10,
+            keepalives_count=3,
         )
-        cursor = connection.cursor()
-        
-        # Query to get the latest record for the filtered plant and unit
-        latest_batch_query = f"""
-        SELECT batch_id
-        FROM {TABLE_NAME}
-        WHERE site = %s AND unit = %s
-        ORDER BY id DESC
-        LIMIT 1;
-        """
-        cursor.execute(latest_batch_query, (PLANT_FILTER, UNIT_FILTER))
-        latest_batch_id = cursor.fetchone()
-        
-        if not latest_batch_id or latest_batch_id[0] is None:
-            print(f"No records found for site '{PLANT_FILTER}' and unit '{UNIT_FILTER}'.")
-            return None, pd.DataFrame()
-
-        batch_id = latest_batch_id[0]
-        
-        # Query to get all records associated with the latest batch ID for the filtered plant and unit
-        batch_records_query = f"""
-        SELECT id, step, start_time
-        FROM {TABLE_NAME}
-        WHERE batch_id = %s AND site = %s AND unit = %s
-        ORDER BY id ASC;
-        """
-        cursor.execute(batch_records_query, (batch_id, PLANT_FILTER, UNIT_FILTER))
-        records = cursor.fetchall()
-        
-        df = pd.DataFrame(records, columns=["id", "step", "start_time"])
-        return batch_id, df
+    return _pool
 
-    except Exception as e:
-        print(f"Error fetching current batch records: {e}")
-        return None, pd.DataFrame()
+# Function to close every pooled connection on shutdown
+def close_pool():
+    global _pool
+    if _pool is not None:
+        _pool.closeall()
+        _pool = None
+
+# Function to check out a connection that is still usable
+def checkout_connection():
+    pool = get_pool()
+    connection = pool.getconn()
+    if connection.closed or connection.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+        # Connection was dropped while it sat in the pool, replace it
+        pool.putconn(connection, close=True)
+        connection = pool.getconn()
+    elif connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        connection.rollback()
+    return connection
+
+# Function to run a prepared statement and return all rows.
+# A dropped connection is discarded and the statement retried once on a fresh one.
+def execute_prepared(name, params):
+    for attempt in range(2):
+        pool = get_pool()
+        connection = checkout_connection()
+        placeholders = ", ".join(["%s"] * len(params))
+        query = f"EXECUTE {name} ({placeholders});" if params else f"EXECUTE {name};"
+        if name not in connection.prepared:
+            # Prepare and execute in the same round trip
+            query = f"PREPARE {name} AS {PREPARED_STATEMENTS[name]};\n" + query
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(query, params)
+                rows = cursor.fetchall()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            pool.putconn(connection, close=True)
+            if attempt:
+                raise
+            print(f"Database connection lost ({e}), reconnecting...")
+            continue
+        except Exception:
+            pool.putconn(connection)
+            raise
+        connection.prepared.add(name)
+        pool.putconn(connection)
+        return rows
 
+# Function to stream the rows of a query through a named (server-side) cursor.
+# Rows are pulled FETCH_SIZE at a time, so memory stays flat whatever the result size.
+def stream_query(query, params):
+    pool = get_pool()
+    connection = checkout_connection()
+    connection.autocommit = False  # Server-side cursors live inside a transaction
+    broken = False
+    try:
+        with connection.cursor(name="fetcher_stream") as cursor:
+            cursor.itersize = FETCH_SIZE
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(FETCH_SIZE)
+                if not rows:
+                    break
+                yield from rows
+        connection.commit()
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
     finally:
-        if connection:
-            cursor.close()
-            connection.close()
+        if broken or connection.closed:
+            pool.putconn(connection, close=True)
+        else:
+            connection.rollback()
+            connection.autocommit = True
+            pool.putconn(connection)
 
-# Function to fetch new records for the filtered plant and unit since the last ID
-def get_new_records(last_id):
+# Function to stop early when notify mode has no channel to use
+def require_notify_channel():
+    if not NOTIFY_CHANNEL:
+        raise ValueError("FETCH_MODE=notify needs TABLE_NAME or NOTIFY_CHANNEL to be set")
+
+# Function to install the trigger that NOTIFYs listeners when step rows are inserted.
+# The trigger is per statement, so a bulk insert sends one notification per
+# site/unit instead of one per row.
+def install_notify_trigger():
+    require_notify_channel()
+    connection = psycopg2.connect(
+        host=DB_HOST,
+        port=DB_PORT,
+        database=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD
+    )
     try:
-        connection = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        cursor = connection.cursor()
-        
-        new_records_query = f"""
-        SELECT id, step, start_time
-        FROM {TABLE_NAME}
-        WHERE id > %s AND site = %s AND unit = %s
-        ORDER BY id ASC;
-        """
-        cursor.execute(new_records_query, (last_id, PLANT_FILTER, UNIT_FILTER))
-        records = cursor.fetchall()
-        
-        df = pd.DataFrame(records, columns=["id", "step", "start_time"])
-        return df
+        with connection, connection.cursor() as cursor:
+            cursor.execute(f"""
+            CREATE OR REPLACE FUNCTION {TABLE_NAME}_notify() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify('{NOTIFY_CHANNEL}', site_unit)
+                FROM (SELECT DISTINCT site || '/' || unit AS site_unit FROM new_rows) AS inserted;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+
+            DROP TRIGGER IF EXISTS {TABLE_NAME}_notify ON {TABLE_NAME};
+            CREATE TRIGGER {TABLE_NAME}_notify
+            AFTER INSERT ON {TABLE_NAME}
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION {TABLE_NAME}_notify();
+            """)
+        print(f"Installed NOTIFY trigger on {TABLE_NAME} (channel '{NOTIFY_CHANNEL}').")
+    finally:
+        connection.close()
+
+# Function to open the dedicated connection that LISTENs for inserts.
+# LISTEN is session state, so this connection is kept out of the pool.
+def open_listen_connection():
+    connection = psycopg2.connect(
+        host=DB_HOST,
+        port=DB_PORT,
+        database=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        keepalives=1,
+        keepalives_idle=30,
+        keepalives_interval=10,
+        keepalives_count=3,
+    )
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        # Quoted, so Postgres does not fold it to lower case and miss pg_notify's literal name
+        cursor.execute(sql.SQL("LISTEN {};").format(sql.Identifier(NOTIFY_CHANNEL)))
+    return connection
+
+# Function to block on the listen socket until notified or the timeout expires.
+# Returns the set of "site/unit" payloads received, so a burst of inserts is
+# coalesced into a single fetch. An empty set means the wait timed out.
+def wait_for_notifications(connection, timeout):
+    units = set()
+    if not connection.notifies:
+        if not select.select([connection], [], [], timeout)[0]:
+            return units
+        connection.poll()
+
+    deadline = time.monotonic() + NOTIFY_COALESCE
+    while True:
+        while connection.notifies:
+            units.add(connection.notifies.pop(0).payload)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not select.select([connection], [], [], remaining)[0]:
+            return units
+        connection.poll()
+
+# Function to fetch one page of new records of the units in offsets since the lowest unit offset.
+# Records are plain (id, site, unit, batch_id, step, start_time) tuples.
+def get_new_records(offsets):
+    try:
+        sites = [site for site, _ in offsets]
+        unit_names = [unit for _, unit in offsets]
+        return execute_prepared("new_records", (min(offsets.values()), sites, unit_names, FETCH_SIZE))
 
     except Exception as e:
         print(f"Error fetching new records: {e}")
-        return pd.DataFrame()
+        return []
 
-    finally:
-        if connection:
-            cursor.close()
-            connection.close()
+# Function to encode the records that are past their unit's offset.
+# Returns the messages (encoded per codec.MESSAGE_CODEC) grouped by Redis list, in ID order within each list,
+# and the number of messages per unit.
+def encode_records(records, offsets):
+    messages = {}
+    counts = {}
+    for record_id, site, unit, batch_id, step, start_time in records:
+        if record_id > offsets[(site, unit)]:
+            messages.setdefault(UNIT_KEYS[(site, unit)], []).append(
+                codec.encode(record_id, site, unit, batch_id, step, codec.to_epoch(start_time))
+            )
+            counts[(site, unit)] = counts.get((site, unit), 0) + 1
+    return messages, counts
 
-# Function to push record to Redis
-def push_to_redis(step, start_time):
+# Function to load the checkpointed offsets of the watched units
+def load_checkpoints():
     try:
-        # Create JSON message to be pushed to Redis
-        record = {
-            "step": step,
-            "start_time": start_time.strftime('%Y-%m-%d %H:%M:%S')  # Format datetime object
-        }
-        # Convert the dictionary to a JSON string
-        json_record = json.dumps(record)
-        
-        # Push to Redis list
-        r.lpush(REDIS_LIST_NAME, json_record)
-        print(f"Pushed to Redis: {json_record}")
+        if CHECKPOINT_BACKEND == "redis":
+            saved = r.hgetall(CHECKPOINT_KEY)
+        elif CHECKPOINT_BACKEND == "file" and os.path.exists(CHECKPOINT_FILE):
+            with open(CHECKPOINT_FILE) as f:
+                saved = json.load(f)
+        else:
+            saved = {}
+    except Exception as e:
+        print(f"Error loading checkpoints, starting without them: {e}")
+        saved = {}
+
+    return {
+        (site, unit): int(saved[f"{site}/{unit}"])
+        for site, unit in WATCHED_UNITS
+        if f"{site}/{unit}" in saved
+    }
+
+# Function to write offsets to the checkpoint file.
+# Writes a temporary file and renames it over the old one, so a crash never leaves
+# a half-written checkpoint behind.
+def save_checkpoint_file(offsets):
+    saved = {}
+    if os.path.exists(CHECKPOINT_FILE):
+        with open(CHECKPOINT_FILE) as f:
+            saved = json.load(f)
+    saved.update({f"{site}/{unit}": last_id for (site, unit), last_id in offsets.items()})
+
+    temp_file = f"{CHECKPOINT_FILE}.tmp"
+    with open(temp_file, "w") as f:
+        json.dump(saved, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, CHECKPOINT_FILE)
+
+# Function to push encoded messages to Redis and checkpoint the offsets they reach.
+# Every list gets multi-value LPUSHes of at most REDIS_CHUNK_SIZE messages (or every
+# stream one XADD per message, see transport.REDIS_TRANSPORT), all sent in one
+# pipeline, so a whole fetch costs a single round trip.
+# With the Redis backend the checkpoint is written in the same MULTI/EXEC as the
+# messages, so either both land or neither does.
+def push_to_redis(messages, offsets):
+    try:
+        pipe = r.pipeline(transaction=CHECKPOINT_BACKEND == "redis")
+        for key, key_messages in messages.items():
+            transport.add_messages(pipe, key, key_messages, REDIS_CHUNK_SIZE)
+        if CHECKPOINT_BACKEND == "redis" and offsets:
+            pipe.hset(CHECKPOINT_KEY, mapping={f"{site}/{unit}": last_id for (site, unit), last_id in offsets.items()})
+        pipe.execute()
+
+        if CHECKPOINT_BACKEND == "file" and offsets:
+            save_checkpoint_file(offsets)
+
+        if not QUIET:
+            for key_messages in messages.values():
+                for json_record in key_messages:
+                    print(f"Pushed to Redis: {json_record}")
+        return True
 
     except Exception as e:
-        print(f"Error pushing record to Redis: {e}")
+        print(f"Error pushing records to Redis: {e}")
+        return False
 
-# Main loop
-def poll_new_steps():
-    current_batch_id, batch_df = get_current_batch_records()
-    if current_batch_id is None:
-        print("Exiting: No records found for the specified plant and unit.")
-        return
+# Function to push records, FETCH_SIZE at a time, from any iterable in ID order.
+# Every unit covered by the query has been read up to the last ID of each page,
+# so all offsets move there (and are checkpointed) once the page is in Redis.
+# Returns the number of records pushed per unit, and False if a push failed.
+def push_records(records, offsets):
+    pushed = {}
+    records = iter(records)
+    while True:
+        page = list(islice(records, FETCH_SIZE))
+        if not page:
+            return pushed, True
+
+        messages, counts = encode_records(page, offsets)
+        last_id = page[-1][0]
+        new_offsets = {unit: max(offset, last_id) for unit, offset in offsets.items()}
+        if not push_to_redis(messages, new_offsets):
+            return pushed, False  # Offsets stay put so the rows are fetched again on the next poll
+
+        offsets.update(new_offsets)
+        for unit, count in counts.items():
+            pushed[unit] = pushed.get(unit, 0) + count
 
-    print(f"Current batch ID: {current_batch_id}")
-    print(f"Initial records:\n{batch_df[['step', 'start_time']]}")
+# Function to stream the latest batch of the given units into Redis.
+# Once every record is in Redis, the units move on to the highest ID seen before
+# the batches were read, so a unit without rows does not keep the next polls
+# scanning from ID 0. Returns the batch ID found for each unit, and whether the
+# push got through; if not, the offsets stay put and the push can be retried.
+def push_current_batches(offsets, units):
+    batch_ids = {}
+    batch_offsets = {unit: offsets[unit] for unit in units}
+    finished = False
 
-    last_id = batch_df["id"].max() if not batch_df.empty else 0
+    def track_batches(records):
+        for record in records:
+            batch_ids[(record[1], record[2])] = record[3]
+            yield record
+
+    try:
+        # Read first: a row inserted while the batches stream in is above it
+        max_id = execute_prepared("max_id", ())[0][0]
+        sites = [site for site, _ in units]
+        unit_names = [unit for _, unit in units]
+        pushed, finished = push_records(track_batches(stream_query(BATCH_RECORDS_QUERY, (sites, unit_names))), batch_offsets)
+        print(f"Pushed {sum(pushed.values())} initial records to Redis.")
+    except Exception as e:
+        print(f"Error fetching current batch records: {e}")
+
+    if finished:
+        # The latest batch holds a unit's newest rows, so nothing of it is left below max_id
+        batch_offsets = {unit: max(offset, max_id) for unit, offset in batch_offsets.items()}
+    offsets.update(batch_offsets)
+    return batch_ids, finished
+
+# Main loop. Units with a checkpoint resume from it; the others (or every unit
+# with resync) start by pushing their whole current batch.
+def poll_new_steps(resync=False):
+    if FETCH_MODE == "notify":
+        require_notify_channel()
+
+    # Per-unit offsets: every row of the unit up to this ID has been handled
+    offsets = {unit: 0 for unit in WATCHED_UNITS}
+    checkpoints = {} if resync else load_checkpoints()
+    offsets.update(checkpoints)
+    for (site, unit), last_id in checkpoints.items():
+        print(f"Resuming site '{site}' and unit '{unit}' from checkpoint ID {last_id}")
 
     # Push initial records to Redis
-    for _, row in batch_df.iterrows():
-        push_to_redis(row['step'], row['start_time'])
+    unsynced_units = [unit for unit in WATCHED_UNITS if unit not in checkpoints]
+    if unsynced_units:
+        while True:
+            batch_ids, pushed = push_current_batches(offsets, unsynced_units)
+            if pushed:
+                break
+            print(f"Retrying the current batches in {POLL_INTERVAL} seconds...")
+            time.sleep(POLL_INTERVAL)
+        if not batch_ids and not checkpoints:
+            print("Exiting: No records found for the specified plants and units.")
+            return
+
+        for site, unit in unsynced_units:
+            if (site, unit) in batch_ids:
+                print(f"Current batch ID for site '{site}' and unit '{unit}': {batch_ids[(site, unit)]}")
+            else:
+                print(f"No records found for site '{site}' and unit '{unit}'.")
+
+    if FETCH_MODE == "notify":
+        listen_for_new_steps(offsets)
+        return
 
+    # Only the units that are due are queried, still with a single range query
+    scheduler = PollScheduler(WATCHED_UNITS)
     while True:
-        print(f"Polling for new records since ID {last_id} for site '{PLANT_FILTER}' and unit '{UNIT_FILTER}'...")
-        new_records_df = get_new_records(last_id)
-        
-        if not new_records_df.empty:
-            last_id = new_records_df["id"].max()
-            new_records_df = new_records_df[["step", "start_time"]]
-            for _, row in new_records_df.iterrows():
-                push_to_redis(row['step'], row['start_time'])
-            print(f"New records found and pushed to Redis.")
-        else:
-            print("No new records found.")
+        due_units = scheduler.due_units(time.monotonic())
+        if due_units:
+            due_offsets = {unit: offsets[unit] for unit in due_units}
+            print(f"Polling for new records since ID {min(due_offsets.values())} for {len(due_units)} units...")
+            pushed = push_new_records(due_offsets)
+            offsets.update(due_offsets)
+            scheduler.record(due_units, pushed, time.monotonic())
+            scheduler.export()
+
+        time.sleep(max(0.0, scheduler.next_poll() - time.monotonic()))
+
+# Function to fetch and push records past the unit offsets, updating them in place.
+# A full page means more rows are waiting, so keep paging until caught up.
+# Returns the number of records pushed per unit.
+def push_new_records(offsets):
+    pushed = {}
+    while True:
+        floor = min(offsets.values())
+        records = get_new_records(offsets)
+        for unit, count in push_records(records, offsets)[0].items():
+            pushed[unit] = pushed.get(unit, 0) + count
+        if len(records) < FETCH_SIZE or min(offsets.values()) == floor:
+            break
+
+    if pushed:
+        print(f"{sum(pushed.values())} new records found and pushed to Redis.")
+    else:
+        print("No new records found.")
+    return pushed
+
+
+class PollScheduler:
+    """Per-unit adaptive poll intervals.
+
+    A unit that returned rows has its interval divided by POLL_BACKOFF (straight to
+    POLL_INTERVAL_MIN after a burst of a full page or more). A quiet unit has it
+    multiplied by POLL_BACKOFF, up to POLL_INTERVAL_MAX. Every next poll time gets
+    +/- POLL_JITTER so quiet units do not poll in lockstep.
+    """
+    def __init__(self, units):
+        self.intervals = {unit: POLL_INTERVAL for unit in units}
+        self.next_due = {unit: 0.0 for unit in units}
+        self.changed = set(units)
+
+    def due_units(self, now):
+        return [unit for unit, due in self.next_due.items() if due <= now]
 
-        time.sleep(POLL_INTERVAL)
+    def next_poll(self):
+        return min(self.next_due.values())
+
+    def record(self, units, pushed, now):
+        for unit in units:
+            interval = self.intervals[unit]
+            count = pushed.get(unit, 0)
+            if count >= FETCH_SIZE:
+                new_interval = POLL_INTERVAL_MIN
+            elif count:
+                new_interval = max(POLL_INTERVAL_MIN, interval / POLL_BACKOFF)
+            else:
+                new_interval = min(POLL_INTERVAL_MAX, interval * POLL_BACKOFF)
+            new_interval = min(POLL_INTERVAL_MAX, max(POLL_INTERVAL_MIN, new_interval))
+
+            if new_interval != interval:
+                self.intervals[unit] = new_interval
+                self.changed.add(unit)
+            self.next_due[unit] = now + new_interval * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+
+    def export(self):
+        """Publish the intervals that changed since the last export to POLL_INTERVAL_KEY"""
+        if not self.changed:
+            return
+        try:
+            r.hset(POLL_INTERVAL_KEY, mapping={
+                f"{site}/{unit}": self.intervals[(site, unit)] for site, unit in self.changed
+            })
+            self.changed.clear()
+        except Exception as e:
+            print(f"Error exporting poll intervals to Redis: {e}")
+
+# Notification loop: fetch only when the trigger reports an insert for a watched unit.
+# Falls back to a plain poll when nothing arrives for NOTIFY_FALLBACK_INTERVAL,
+# and catches up with a range fetch after every (re)connect.
+def listen_for_new_steps(offsets):
+    watched = {f"{site}/{unit}" for site, unit in WATCHED_UNITS}
+    connection = None
+
+    while True:
+        try:
+            if connection is None:
+                connection = open_listen_connection()
+                print(f"Listening on '{NOTIFY_CHANNEL}' for {len(WATCHED_UNITS)} units...")
+                push_new_records(offsets)
+
+            units = wait_for_notifications(connection, NOTIFY_FALLBACK_INTERVAL)
+            if not units or not watched.isdisjoint(units):
+                push_new_records(offsets)
+
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            print(f"Lost notification connection ({e}), reconnecting in {POLL_INTERVAL} seconds...")
+            if connection is not None and not connection.closed:
+                connection.close()
+            connection = None
+            time.sleep(POLL_INTERVAL)
 
 if __name__ == "__main__":
-    poll_new_steps()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Push new site_run_detail steps to Redis.")
+    parser.add_argument("--install-trigger", action="store_true",
+                        help="install the NOTIFY trigger used by FETCH_MODE=notify and exit")
+    parser.add_argument("--resync", action="store_true",
+                        help="ignore checkpoints and push the whole current batch of every unit again")
+    args = parser.parse_args()
+
+    if args.install_trigger:
+        install_notify_trigger()
+    else:
+        try:
+            poll_new_steps(resync=args.resync)
+        finally:
+            close_pool()
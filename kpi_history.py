@@ -0,0 +1,116 @@
+import math
+import os
+
+import numpy as np
+
+from step_table import from_seconds, to_seconds
+
+# In-memory KPI history of completed steps, per (site, unit, step).
+#
+# Every completion adds its final elapsed/active/idle time and processing
+# performance to fixed-size ring buffers at several resolutions. A buffer of
+# resolution R with N slots keeps count/sum/min/max per metric for the last N
+# buckets of R seconds; a slot is reused once its bucket falls out of that span.
+# Memory per series is fixed (64 bytes per slot), so it never grows with uptime.
+#
+# HISTORY_RESOLUTIONS is "bucket seconds:slots,...", finest first. The default
+# keeps 15-minute buckets for a day, hourly for a week and daily for 90 days.
+HISTORY_RESOLUTIONS = [
+    tuple(int(value) for value in resolution.split(":"))
+    for resolution in os.getenv("HISTORY_RESOLUTIONS", "900:96,3600:168,86400:90").split(",")
+]
+
+METRICS = ("elapsed_time", "active_time", "idle_time", "processing_performance")
+COUNT, SUM, MIN, MAX = range(4)
+
+
+class RingBuffer:
+    """count/sum/min/max of every metric for the last slots buckets of seconds each"""
+    def __init__(self, seconds, slots):
+        self.seconds = seconds
+        self.slots = slots
+        self.buckets = np.full(slots, -1, dtype=np.int64)  # Bucket number held by each slot
+        self.stats = np.zeros((slots, len(METRICS), 4), dtype=np.float32)
+        self.dropped = 0  # Points too old for the span still kept
+
+    def add(self, time, values):
+        bucket = int(time // self.seconds)
+        slot = bucket % self.slots
+        if bucket < self.buckets[slot]:
+            # A late point whose bucket was already reused by a newer one
+            self.dropped += 1
+            return
+        stats = self.stats[slot]
+        if self.buckets[slot] != bucket:
+            self.buckets[slot] = bucket
+            stats[:, COUNT] = 0
+            stats[:, SUM] = 0
+            stats[:, MIN] = np.inf
+            stats[:, MAX] = -np.inf
+        stats[:, COUNT] += 1
+        stats[:, SUM] += values
+        np.minimum(stats[:, MIN], values, out=stats[:, MIN])
+        np.maximum(stats[:, MAX], values, out=stats[:, MAX])
+
+    def oldest(self):
+        """First bucket number still kept: the latest one filled less slots - 1"""
+        return int(self.buckets.max()) - self.slots + 1
+
+    def window(self, start, end):
+        """Bucket numbers and stats of the filled buckets from start up to end (epoch seconds, end excluded)"""
+        first = max(int(start // self.seconds), self.oldest())  # Older buckets are gone
+        last = min(math.ceil(end / self.seconds) - 1, int(self.buckets.max()))
+        buckets = np.arange(first, last + 1)
+        slots = buckets % self.slots
+        filled = self.buckets[slots] == buckets
+        return buckets[filled], self.stats[slots[filled]]
+
+
+class KpiHistory:
+    """Ring buffers for every (site, unit, step) that has completed at least once"""
+    def __init__(self, resolutions=HISTORY_RESOLUTIONS):
+        self.resolutions = sorted(resolutions)
+        self.series = {}  # (site, unit, step) -> RingBuffer per resolution, finest first
+
+    def record(self, site, unit, step):
+        """Add the final figures of a completed step at its end time"""
+        series = self.series.get((site, unit, step.name))
+        if series is None:
+            series = self.series[(site, unit, step.name)] = [
+                RingBuffer(seconds, slots) for seconds, slots in self.resolutions
+            ]
+        values = np.array([getattr(step, metric) for metric in METRICS], dtype=np.float32)
+        time = to_seconds(step.end_time)
+        for ring in series:
+            ring.add(time, values)
+
+    def query(self, site, unit, step_name, metric, start, end, resolution=None):
+        """Buckets and aggregate of one metric from start to end (naive datetimes).
+
+        Uses the given resolution (bucket seconds), or the finest one that still
+        keeps the bucket holding start. Runs in O(buckets in the window). Returns
+        None when the step has no history.
+        """
+        series = self.series.get((site, unit, step_name))
+        if series is None:
+            return None
+        start, end = to_seconds(start), to_seconds(end)
+        if resolution is None:
+            ring = next((ring for ring in series if start // ring.seconds >= ring.oldest()), series[-1])
+        else:
+            ring = series[[seconds for seconds, _ in self.resolutions].index(resolution)]
+
+        buckets, stats = ring.window(start, end)
+        stats = stats[:, METRICS.index(metric)].astype(np.float64)
+        count = stats[:, COUNT].sum()
+        return {
+            "resolution": ring.seconds,
+            "buckets": [
+                (from_seconds(bucket * ring.seconds), int(row[COUNT]), row[SUM] / row[COUNT], row[MIN], row[MAX])
+                for bucket, row in zip(buckets.tolist(), stats.tolist())
+            ],
+            "count": int(count),
+            "mean": float(stats[:, SUM].sum() / count) if count else math.nan,
+            "min": float(stats[:, MIN].min()) if count else math.nan,
+            "max": float(stats[:, MAX].max()) if count else math.nan,
+        }
@@ -0,0 +1,115 @@
+import os
+import time
+
+# Live step KPIs in Redis, one hash per unit (KPI_KEY):
+#   batch_id, step         live batch and its current step
+#   <step>.state           PENDING / RUNNING / IDLE / COMPLETE
+#   <step>.elapsed_time, <step>.active_time, <step>.idle_time, <step>.remaining_time
+#                          seconds, KPI_PRECISION decimals
+#   <step>.processing_performance
+#   finished               "1" once the batch is retired, with its final figures
+#   version                bumped by every write to the hash
+# Steps that have not started have no fields. The hash is replaced when a new
+# batch starts on the unit. KPI_VERSION_KEY is bumped once per write of any hash,
+# so readers can poll that one key and re-read the hashes only when it moves.
+KPI_PUBLISH = os.getenv("KPI_PUBLISH", "1") == "1"
+KPI_KEY = os.getenv("KPI_KEY", "kpi:{site}/{unit}")
+KPI_VERSION_KEY = os.getenv("KPI_VERSION_KEY", "kpi:version")
+KPI_INTERVAL = float(os.getenv("KPI_INTERVAL", 1.0))  # Least seconds between two publishes
+KPI_PRECISION = int(os.getenv("KPI_PRECISION", 1))  # Decimals kept, so sub-precision ticks are not sent
+
+TIME_FIELDS = ("elapsed_time", "active_time", "idle_time", "remaining_time")
+
+
+class KpiPublisher:
+    """Writes changed KPI fields of every live batch in one pipeline per publish.
+
+    Like ConsoleRenderer, only the steps from the previous publish's current step up
+    to the present one are looked at, and a field is sent only when its value
+    differs from the one last sent.
+    """
+    def __init__(self, redis_client, interval=KPI_INTERVAL):
+        self.r = redis_client
+        self.interval = interval
+        self.next_publish = 0.0
+        self.published = {}   # (site, unit) -> {field: value last sent}
+        self.first_step = {}  # (site, unit) -> first step index that may still change
+
+    def step_fields(self, step):
+        prefix = step.name
+        fields = {f"{prefix}.state": step.state.name}
+        for field in TIME_FIELDS:
+            fields[f"{prefix}.{field}"] = f"{getattr(step, field):.{KPI_PRECISION}f}"
+        fields[f"{prefix}.processing_performance"] = f"{step.processing_performance:.3f}"
+        return fields
+
+    def publish(self, sequences):
+        now = time.monotonic()
+        if now < self.next_publish:
+            return
+        self.next_publish = now + self.interval
+
+        pipe = self.r.pipeline(transaction=False)
+        writes = 0
+        for (site, unit, batch_id), sequence in sequences.items():
+            writes += self.write(pipe, site, unit, batch_id, sequence)
+        self.execute(pipe, writes)
+
+    def finish(self, key, sequence):
+        """Write the final fields of a batch that is being retired, whatever the interval"""
+        pipe = self.r.pipeline(transaction=False)
+        self.execute(pipe, self.write(pipe, *key, sequence, {"finished": "1"}))
+
+    def write(self, pipe, site, unit, batch_id, sequence, extra=None):
+        """Queue the changed fields of one batch on pipe. Returns 1 if any, else 0."""
+        key = KPI_KEY.format(site=site, unit=unit)
+        published = self.published.get((site, unit))
+        if published is None or published.get("batch_id") != str(batch_id):
+            # New batch on the unit: start its hash from scratch
+            pipe.delete(key)
+            published = self.published[(site, unit)] = {}
+            first = 0
+        else:
+            first = self.first_step[(site, unit)]
+
+        last = min(sequence.current_step_index, len(sequence.steps) - 1)
+        fields = {"batch_id": str(batch_id), "step": sequence.steps[last].name}
+        for i in range(first, last + 1):
+            fields.update(self.step_fields(sequence.steps[i]))
+        fields.update(extra or {})
+        self.first_step[(site, unit)] = last
+
+        changed = {field: value for field, value in fields.items() if published.get(field) != value}
+        if not changed:
+            return 0
+        published.update(changed)
+        pipe.hset(key, mapping=changed)
+        pipe.hincrby(key, "version", 1)
+        return 1
+
+    def execute(self, pipe, writes):
+        if writes:
+            pipe.incr(KPI_VERSION_KEY)
+            try:
+                pipe.execute()
+            except Exception as e:
+                print(f"Error publishing KPIs: {e}")
+                self.published.clear()  # Send everything again next time
+
+
+class NullPublisher:
+    """Publishes nothing"""
+    interval = None
+
+    def publish(self, sequences):
+        pass
+
+    def finish(self, key, sequence):
+        pass
+
+
+# Function to create the configured KPI publisher
+def make_publisher(redis_client):
+    if KPI_PUBLISH:
+        return KpiPublisher(redis_client)
+    return NullPublisher()
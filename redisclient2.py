@@ -1,15 +1,16 @@
 import redis
-import json
-from datetime import datetime
+from codec import decode, to_datetime
+from transport import make_consumer
 
-r = redis.Redis(host='localhost', port=6379, decode_responses=True)
+r = redis.Redis(host='localhost', port=6379, decode_responses=False)
+consumer = make_consumer(r, 'operation_queue')
 
 
-test = r.rpop('operation_queue')
-
-if test:
-    record = json.loads(test)
+for message_id, test in consumer.read(1):
+    record = decode(test)
     
-    datetime_str = record['start_time']
+    datetime_str = record.start_time
     
-    start_time = datetime.strptime(record['start_time'], '%Y-%m-%d %H:%M:%S')
\ No newline at end of file
+    start_time = to_datetime(record.start_time)
+
+    consumer.ack([message_id])
\ No newline at end of file
@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+
+# Renderers for the step engine.
+#   "console" - prints only the steps whose line changed since it was last printed,
+#               at most once every RENDER_INTERVAL seconds, in one write.
+#   "none"    - prints nothing, for headless production runs.
+RENDER_MODE = os.getenv("RENDER_MODE", "console")
+RENDER_INTERVAL = float(os.getenv("RENDER_INTERVAL", 2.0))  # Least seconds between two renders
+
+
+class ConsoleRenderer:
+    """Incremental console output.
+
+    Steps before a sequence's current step are COMPLETE and never change again, and
+    steps after it are still PENDING, so each render only looks at the steps from
+    the previous render's current step up to the present one.
+    """
+    def __init__(self, interval=RENDER_INTERVAL, stream=None):
+        self.interval = interval
+        self.stream = stream or sys.stdout
+        self.next_render = 0.0
+        self.first_step = {}  # (site, unit, batch_id) -> first step index that may still change
+        self.lines = {}       # ((site, unit, batch_id), step index) -> line last printed
+
+    def render(self, frame, sequences):
+        now = time.monotonic()
+        if now < self.next_render:
+            return
+        self.next_render = now + self.interval
+
+        output = []
+        for key, sequence in sequences.items():
+            site, unit, batch_id = key
+            first = self.first_step.get(key)
+            if first is None:
+                first = 0
+                output.append(f"{site}/{unit} batch {batch_id} started")
+
+            last = min(sequence.current_step_index, len(sequence.steps) - 1)
+            for i in range(first, last + 1):
+                line = sequence.steps[i].render()
+                if self.lines.get((key, i)) != line:
+                    self.lines[(key, i)] = line
+                    output.append(f"{site}/{unit} batch {batch_id} {line}")
+            self.first_step[key] = last
+
+        # Forget batches the engine has retired
+        if len(self.first_step) > len(sequences):
+            for key in [key for key in self.first_step if key not in sequences]:
+                last = self.first_step.pop(key)
+                for i in range(last + 1):
+                    self.lines.pop((key, i), None)
+                output.append(f"{key[0]}/{key[1]} batch {key[2]} retired")
+
+        if output:
+            self.stream.write(f"Frame {frame + 1}\n" + "\n".join(output) + "\n" + "-" * 30 + "\n")
+            self.stream.flush()
+
+
+class NullRenderer:
+    """Renders nothing"""
+    interval = None
+
+    def render(self, frame, sequences):
+        pass
+
+
+# Function to create the configured renderer
+def make_renderer(mode=RENDER_MODE):
+    if mode == "none":
+        return NullRenderer()
+    return ConsoleRenderer()
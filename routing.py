@@ -0,0 +1,138 @@
+import csv
+import hashlib
+import io
+import os
+import pickle
+
+# Routing registry for the step engines.
+#
+# ROUTING_FILE is a CSV with one row per step, in step order:
+#   step, duration                      required
+#   is_processing_step                  optional, 0 or 1
+#   machine                             optional, machine of the work centre the step runs on
+#   production_order_number, routing_id optional; rows sharing both form one routing
+# A file without the last two columns (the legacy batch_routing.csv) holds a single
+# routing, registered under DEFAULT_KEY. Batches are matched to routings by
+# production order number (the batch_id of their events); batches without a
+# routing of their own use the default routing.
+#
+# Parsed routings are compiled into plain tuples and cached in ROUTING_CACHE. The
+# cache is used while the file's mtime and size are unchanged, or when its content
+# hash still matches, so the CSV is only parsed again when it really changed.
+ROUTING_FILE = os.getenv("ROUTING_FILE", "batch_routing.csv")
+ROUTING_CACHE = os.getenv("ROUTING_CACHE")  # Defaults to the routing file's path + ".cache"
+CACHE_VERSION = 2
+
+DEFAULT_KEY = (None, None)
+
+
+class Routing:
+    """Compiled routing. Sequences built from it share its step name -> index map."""
+    __slots__ = ("key", "names", "durations", "processing", "machines", "step_index")
+
+    def __init__(self, key, names, durations, processing, machines):
+        self.key = key
+        self.names = names
+        self.durations = durations
+        self.processing = processing
+        self.machines = machines  # None where the step runs on the work centre itself
+        # The first step wins if a name repeats
+        self.step_index = {}
+        for i, name in enumerate(names):
+            self.step_index.setdefault(name, i)
+
+    def instantiate(self, make_step):
+        """Fresh steps for one batch, from make_step(name, standard_duration, is_processing_step)"""
+        return [make_step(*step) for step in zip(self.names, self.durations, self.processing)]
+
+
+# Function to parse routing CSV text into
+# {(production_order_number, routing_id): (names, durations, processing, machines)}
+def compile_routings(text):
+    steps = {}
+    for row in csv.DictReader(io.StringIO(text)):
+        key = (row.get("production_order_number") or None, row.get("routing_id") or None)
+        names, durations, processing, machines = steps.setdefault(key, ([], [], [], []))
+        names.append(row["step"])
+        durations.append(float(row["duration"]))
+        processing.append(int(row.get("is_processing_step") or 0))
+        machines.append(row.get("machine") or None)
+    return {key: tuple(map(tuple, columns)) for key, columns in steps.items()}
+
+
+# Function to order routing ids numerically when they are numbers ("2" before "10"),
+# after them as text otherwise
+def routing_order(routing_id):
+    text = "" if routing_id is None else str(routing_id)
+    return (0, int(text), "") if text.isdigit() else (1, 0, text)
+
+
+class RoutingRegistry:
+    """Routings keyed by (production_order_number, routing_id), reloaded when the file changes"""
+    def __init__(self, path=ROUTING_FILE, cache_path=ROUTING_CACHE):
+        self.path = path
+        self.cache_path = cache_path or f"{path}.cache"
+        self.stamp = None    # (mtime_ns, size) of the file the routings came from
+        self.digest = None   # sha256 of that file
+        self.routings = {}
+        self.by_order = {}   # production_order_number -> its routing with the lowest routing_id
+        self.refresh()
+
+    def refresh(self):
+        """Reload the routings if the file changed since the last call"""
+        stat = os.stat(self.path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self.stamp:
+            return
+
+        cache = self.load_cache()
+        if cache is not None and cache["stamp"] == stamp:
+            digest, compiled = cache["digest"], cache["routings"]
+        else:
+            with open(self.path, "rb") as f:
+                data = f.read()
+            digest = hashlib.sha256(data).hexdigest()
+            if digest == self.digest:
+                self.stamp = stamp  # Touched, but the content is the same
+                return
+            if cache is not None and cache["digest"] == digest:
+                compiled = cache["routings"]
+            else:
+                compiled = compile_routings(data.decode("utf-8-sig"))
+            self.save_cache(stamp, digest, compiled)
+
+        self.stamp = stamp
+        if digest != self.digest:
+            self.digest = digest
+            self.routings = {key: Routing(key, *columns) for key, columns in compiled.items()}
+            self.by_order = {}
+            for key in sorted(self.routings, key=lambda key: routing_order(key[1])):
+                self.by_order.setdefault(key[0], self.routings[key])
+
+    def load_cache(self):
+        try:
+            with open(self.cache_path, "rb") as f:
+                cache = pickle.load(f)
+            return cache if cache.get("version") == CACHE_VERSION else None
+        except Exception:
+            return None  # Missing or unreadable, parse the CSV instead
+
+    def save_cache(self, stamp, digest, compiled):
+        try:
+            temp_file = f"{self.cache_path}.tmp"
+            with open(temp_file, "wb") as f:
+                pickle.dump({"version": CACHE_VERSION, "stamp": stamp, "digest": digest, "routings": compiled}, f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_file, self.cache_path)
+        except Exception as e:
+            print(f"Error writing routing cache {self.cache_path}: {e}")
+
+    def get(self, production_order_number, routing_id):
+        return self.routings.get((production_order_number, routing_id))
+
+    def resolve(self, production_order_number):
+        """Routing for a batch: its production order's routing, else the default one"""
+        routing = self.by_order.get(production_order_number)
+        if routing is None:
+            routing = self.routings.get(DEFAULT_KEY)
+        return routing
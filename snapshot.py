@@ -0,0 +1,114 @@
+import json
+import os
+import struct
+import zlib
+
+import numpy as np
+
+from step_table import from_seconds, to_seconds
+
+# Snapshots of the step engine's live batches, for a warm restart.
+#
+# Layout (zlib-compressed):
+#   <4sBII  magic b"STEP", SNAPSHOT_VERSION, metadata length, step row count
+#   metadata, JSON:
+#     {"clock": epoch seconds or null,
+#      "batches": [[site, unit, batch_id, current_step_index, step count], ...],
+#      "retired": [[site, unit, batch_id], ...],
+#      "offsets": [[site, unit, last record id], ...]}
+#   step rows, STEP_DTYPE, the steps of every batch in batch order
+#
+# Step names and standard durations are not stored: they come from the routing
+# when the batch's Sequence is rebuilt.
+SNAPSHOT_BACKEND = os.getenv("SNAPSHOT_BACKEND", "none")  # "redis", "file" or "none"
+SNAPSHOT_KEY = os.getenv("SNAPSHOT_KEY", "engine:snapshot")
+SNAPSHOT_FILE = os.getenv("SNAPSHOT_FILE", "engine_snapshot.bin")
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", 30))  # Seconds between periodic snapshots
+SNAPSHOT_VERSION = 1
+
+HEADER = struct.Struct("<4sBII")
+MAGIC = b"STEP"
+
+STEP_DTYPE = np.dtype([
+    ("state", "i1"),
+    ("start_time", "<f8"),
+    ("end_time", "<f8"),
+    ("last_update_time", "<f8"),
+    ("elapsed_time", "<f8"),
+    ("idle_time", "<f8"),
+    ("active_time", "<f8"),
+    ("remaining_time", "<f8"),
+    ("processing_performance", "<f8"),
+])
+TIME_FIELDS = ("start_time", "end_time", "last_update_time")
+VALUE_FIELDS = ("elapsed_time", "idle_time", "active_time", "remaining_time", "processing_performance")
+
+
+# Function to encode the engine's live state.
+# sequences maps (site, unit, batch_id) to Sequence; state_codes maps state
+# instances to their StepTable codes.
+def encode_snapshot(sequences, retired, offsets, clock_time, state_codes):
+    batches = []
+    rows = []
+    for (site, unit, batch_id), sequence in sequences.items():
+        batches.append([site, unit, batch_id, sequence.current_step_index, len(sequence.steps)])
+        for step in sequence.steps:
+            rows.append(
+                (state_codes[step.state],)
+                + tuple(to_seconds(getattr(step, field)) for field in TIME_FIELDS)
+                + tuple(getattr(step, field) for field in VALUE_FIELDS)
+            )
+
+    metadata = json.dumps({
+        "clock": None if clock_time is None else to_seconds(clock_time),
+        "batches": batches,
+        "retired": [list(key) for key in retired],
+        "offsets": [[site, unit, last_id] for (site, unit), last_id in offsets.items()],
+    }, separators=(",", ":")).encode()
+    steps = np.array(rows, dtype=STEP_DTYPE)
+    return zlib.compress(HEADER.pack(MAGIC, SNAPSHOT_VERSION, len(metadata), len(steps)) + metadata + steps.tobytes(), 1)
+
+# Function to decode a snapshot into (metadata, step rows)
+def decode_snapshot(data):
+    data = zlib.decompress(data)
+    magic, version, metadata_length, row_count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported engine snapshot (magic {magic!r}, version {version})")
+    metadata = json.loads(data[HEADER.size:HEADER.size + metadata_length])
+    steps = np.frombuffer(data, dtype=STEP_DTYPE, count=row_count, offset=HEADER.size + metadata_length)
+    return metadata, steps
+
+# Function to write decoded step rows back onto a rebuilt Sequence.
+# states maps StepTable codes to state instances.
+def restore_steps(sequence, current_step_index, rows, states):
+    sequence.current_step_index = current_step_index
+    for step, row in zip(sequence.steps, rows.tolist()):
+        step.state = states[row[0]]
+        for field, value in zip(TIME_FIELDS, row[1:4]):
+            setattr(step, field, from_seconds(value))
+        for field, value in zip(VALUE_FIELDS, row[4:]):
+            setattr(step, field, value)
+
+
+# Function to store a snapshot in the configured backend.
+# Files are written to a temporary file and renamed over the old one, so a crash
+# never leaves a half-written snapshot behind.
+def save_snapshot(redis_client, data):
+    if SNAPSHOT_BACKEND == "redis":
+        redis_client.set(SNAPSHOT_KEY, data)
+    elif SNAPSHOT_BACKEND == "file":
+        temp_file = f"{SNAPSHOT_FILE}.tmp"
+        with open(temp_file, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, SNAPSHOT_FILE)
+
+# Function to read the stored snapshot, or None
+def load_snapshot(redis_client):
+    if SNAPSHOT_BACKEND == "redis":
+        return redis_client.get(SNAPSHOT_KEY)
+    if SNAPSHOT_BACKEND == "file" and os.path.exists(SNAPSHOT_FILE):
+        with open(SNAPSHOT_FILE, "rb") as f:
+            return f.read()
+    return None
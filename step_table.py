@@ -0,0 +1,157 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Struct-of-arrays store for step timing.
+#
+# Each step is one row. Times are float epoch seconds (naive DCS time taken as UTC,
+# NaN when not set), durations are float seconds and the state is a small integer
+# code. StepTable.update() advances every running and idle step with a handful of
+# numpy operations instead of one datetime calculation per Step object.
+
+PENDING, RUNNING, IDLE, COMPLETE = 0, 1, 2, 3
+FREE = -1  # Row released and waiting for reuse
+
+EPOCH = datetime(1970, 1, 1)
+IDLE_AFTER = 0.001  # A step goes IDLE this long after its active time reaches standard_duration
+
+# Time columns hold epoch seconds; every other column is seconds or a ratio
+TIME_COLUMNS = ("start_time", "end_time", "last_update_time")
+FLOAT_COLUMNS = TIME_COLUMNS + (
+    "standard_duration",
+    "elapsed_time",
+    "idle_time",
+    "active_time",
+    "remaining_time",
+    "processing_performance",
+)
+
+
+# Function to convert a naive datetime to float epoch seconds (NaN for None)
+def to_seconds(value):
+    return np.nan if value is None else (value - EPOCH).total_seconds()
+
+# Function to convert float epoch seconds back to a naive datetime (None for NaN)
+def from_seconds(seconds):
+    return None if seconds != seconds else EPOCH + timedelta(seconds=float(seconds))
+
+
+class StepTable:
+    """Timing columns for many steps, grown by doubling, with released rows reused"""
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.size = 0    # Rows handed out so far; rows past this are unused
+        self.free = []   # Released rows below size
+        self.names = []  # Step name of each row, for logging
+        self.assets = []  # Asset node of each row, for rollups of vectorized transitions
+        for column in FLOAT_COLUMNS:
+            setattr(self, column, np.full(capacity, np.nan))
+        self.state = np.full(capacity, FREE, dtype=np.int8)
+        self.is_processing_step = np.zeros(capacity, dtype=bool)
+
+    def grow(self):
+        fills = dict.fromkeys(FLOAT_COLUMNS, np.nan)
+        fills.update(state=FREE, is_processing_step=False)
+        self.capacity *= 2
+        for column, fill in fills.items():
+            old = getattr(self, column)
+            new = np.full(self.capacity, fill, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, column, new)
+
+    def add(self, name, standard_duration, is_processing_step=0):
+        """Returns the row of a new PENDING step"""
+        if self.free:
+            row = self.free.pop()
+            self.names[row] = name
+            self.assets[row] = None
+        else:
+            if self.size == self.capacity:
+                self.grow()
+            row = self.size
+            self.size += 1
+            self.names.append(name)
+            self.assets.append(None)
+
+        for column in TIME_COLUMNS:
+            getattr(self, column)[row] = np.nan
+        self.standard_duration[row] = standard_duration
+        self.elapsed_time[row] = 0
+        self.idle_time[row] = 0
+        self.active_time[row] = 0
+        self.remaining_time[row] = 0
+        self.processing_performance[row] = 1.0  # Default 100%
+        self.is_processing_step[row] = bool(is_processing_step)
+        self.state[row] = PENDING
+        return row
+
+    def release(self, row):
+        self.state[row] = FREE
+        self.names[row] = None
+        self.assets[row] = None
+        self.free.append(row)
+
+    def update(self, now):
+        """Advance every RUNNING and IDLE step to now (epoch seconds).
+
+        Same accounting as Step.update: RunningState.update / IdleState.update, with
+        an update that crosses the IDLE point split there, so the time past it counts
+        as idle. Returns the rows that went from RUNNING to IDLE in this call.
+        """
+        n = self.size
+        state = self.state[:n]
+        last_update_time = self.last_update_time[:n]
+        # Rows already accounted up to now or later are left alone, as in Step.update
+        ahead = last_update_time < now
+        running = (state == RUNNING) & ahead
+        idle = (state == IDLE) & ahead
+        live = running | idle
+
+        active_time = self.active_time[:n]
+        idle_time = self.idle_time[:n]
+        standard_duration = self.standard_duration[:n]
+
+        since_last_update = now - last_update_time
+        np.add(active_time, since_last_update, out=active_time, where=running)
+        np.add(idle_time, since_last_update, out=idle_time, where=idle)
+        np.subtract(now, self.start_time[:n], out=self.elapsed_time[:n], where=live)
+        np.copyto(last_update_time, now, where=live)
+
+        # Processing steps run at 100% until standard_duration, then at the ratio of
+        # standard to active time. Other steps go IDLE once past standard_duration.
+        processing = self.is_processing_step[:n]
+        over_time = running & (active_time > standard_duration)
+        went_idle = np.flatnonzero(over_time & ~processing)
+
+        # Time past the IDLE point counts as idle, as in Step.update. The IDLE point
+        # is the active time before this update (or standard_duration) + IDLE_AFTER.
+        idle_at = np.maximum(active_time[went_idle] - since_last_update[went_idle], standard_duration[went_idle]) + IDLE_AFTER
+        past_idle = np.maximum(active_time[went_idle] - idle_at, 0)
+        idle_time[went_idle] += past_idle
+        active_time[went_idle] -= past_idle
+
+        np.maximum(standard_duration - active_time, 0, out=self.remaining_time[:n], where=running)
+        np.copyto(self.processing_performance[:n], 1.0, where=running & processing)
+        np.divide(standard_duration, active_time, out=self.processing_performance[:n],
+                  where=over_time & processing)
+
+        state[went_idle] = IDLE
+        return went_idle
+
+
+# Function to expose one StepTable column as an attribute of a row-backed step.
+# Time columns read and write naive datetimes, the rest plain floats.
+def table_column(column):
+    if column in TIME_COLUMNS:
+        def get_value(step):
+            return from_seconds(getattr(step.table, column)[step.row])
+
+        def set_value(step, value):
+            getattr(step.table, column)[step.row] = to_seconds(value)
+    else:
+        def get_value(step):
+            return float(getattr(step.table, column)[step.row])
+
+        def set_value(step, value):
+            getattr(step.table, column)[step.row] = value
+    return property(get_value, set_value)
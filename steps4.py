@@ -2,22 +2,13 @@ import time
 from datetime import datetime
 import redis
 from abc import ABC, abstractmethod
-import json
+from clock import make_clock
+from codec import decode, to_datetime
 
-import logging
-import pandas as pd
-# get a custom logger & set the logging level
-py_logger = logging.getLogger("logfile")
-py_logger.setLevel(logging.INFO)
-
-# configure the handler and formatter as needed
-py_handler = logging.FileHandler("logfile.log", mode='w')
-py_formatter = logging.Formatter("%(name)s %(asctime)s %(levelname)s %(message)s")
-
-# add formatter to the handler
-py_handler.setFormatter(py_formatter)
-# add handler to the logger
-py_logger.addHandler(py_handler)
+from engine_logging import get_logger
+from routing import RoutingRegistry
+# Logger (queued JSON lines, see engine_logging)
+py_logger = get_logger("logfile")
 
 
 
@@ -27,7 +18,7 @@ py_logger.addHandler(py_handler)
 # Abstract State Base Class
 class StepState(ABC):
     @abstractmethod
-    def handle_event(self, step, event):
+    def handle_event(self, step, event, event_time=None):
         pass
 
     @abstractmethod
@@ -41,12 +32,12 @@ class StepState(ABC):
 
 # State Classes
 class PendingState(StepState):
-    def handle_event(self, step, event):
+    def handle_event(self, step, event, event_time=None):
         if event == "start":
-            step.start_time = datetime.now()
+            step.start_time = event_time or datetime.now()
             step.state = RunningState()
             step.last_update_time = step.start_time
-            py_logger.info(f"Step {step.name} started.")
+            py_logger.info("Step %s started.", step.name)
 
     def update(self, step, current_time):
         pass  # No updates in PENDING state
@@ -56,13 +47,15 @@ class PendingState(StepState):
 
 
 class RunningState(StepState):
-    def handle_event(self, step, event):
+    def handle_event(self, step, event, event_time=None):
         if event == "complete":
-            step.end_time = datetime.now()
+            step.end_time = event_time or datetime.now()
             step.elapsed_time = (step.end_time - step.start_time).total_seconds()
             step.state = CompleteState()
-            py_logger.info(f"Step {step.name} completed. Finalized attributes:")
-            py_logger.info(step.render())
+            py_logger.info(
+                "Step %s completed: elapsed %.2f s, idle %.2f s, active %.2f s, performance %.2f",
+                step.name, step.elapsed_time, step.idle_time, step.active_time, step.processing_performance,
+            )
 
     def update(self, step, current_time):
         step.active_time += (current_time - step.last_update_time).total_seconds()
@@ -74,7 +67,7 @@ class RunningState(StepState):
         if step.active_time > step.standard_duration and step.is_processing_step == 0:
             step.state = IdleState()
             step.last_idle_time_update = current_time
-            py_logger.info(f"Step {step.name} is now IDLE.")
+            py_logger.info("Step %s is now IDLE.", step.name)
         
         # Mechanism for calculting the step performance if its a processing step
         
@@ -97,21 +90,22 @@ class RunningState(StepState):
 
 
 class IdleState(StepState):
-    def handle_event(self, step, event):
+    def handle_event(self, step, event, event_time=None):
         if event == "resume":
             step.state = RunningState()
-            step.last_update_time = datetime.now()
-            py_logger.info(f"Step {step.name} resumed.")
+            step.last_update_time = event_time or datetime.now()
+            py_logger.info("Step %s resumed.", step.name)
         elif event == "complete":
-            step.end_time = datetime.now()
+            step.end_time = event_time or datetime.now()
             step.elapsed_time = (step.end_time - step.start_time).total_seconds()
             step.state = CompleteState()
-            py_logger.info(f"Step {step.name} completed from IDLE state.")
+            py_logger.info("Step %s completed from IDLE state.", step.name)
 
     def update(self, step, current_time):
         step.idle_time += (current_time - step.last_idle_time_update).total_seconds()
         step.elapsed_time += (current_time - step.last_update_time).total_seconds()
         step.last_idle_time_update = current_time
+        step.last_update_time = current_time
 
     def render(self, step):
         return (
@@ -125,7 +119,7 @@ class IdleState(StepState):
 
 
 class CompleteState(StepState):
-    def handle_event(self, step, event):
+    def handle_event(self, step, event, event_time=None):
         pass  # No events are processed in COMPLETE state
 
     def update(self, step, current_time):
@@ -157,10 +151,12 @@ class Step:
         self.last_update_time = None
         self.last_idle_time_update = None
 
-    def handle_event(self, event):
-        self.state.handle_event(self, event)
+    def handle_event(self, event, event_time=None):
+        self.state.handle_event(self, event, event_time)
 
     def update(self, current_time):
+        if self.last_update_time is not None and current_time <= self.last_update_time:
+            return  # Already accounted up to a later time
         self.state.update(self, current_time)
 
     def render(self):
@@ -180,26 +176,26 @@ class StepSequence:
         )
         
         if step_index is None:
-            py_logger.info(f"Warning: Step {step_name} not found in sequence.")
+            py_logger.info("Warning: Step %s not found in sequence.", step_name)
             return
     
         if step_index <= self.current_step_index:
-            py_logger.info(f"Warning: Ignoring step {step_name} as it is behind or already completed.")
+            py_logger.info("Warning: Ignoring step %s as it is behind or already completed.", step_name)
             return
     
         # Mark all skipped steps as complete
         for i in range(self.current_step_index, step_index):
             skipped_step = self.steps[i]
             if not isinstance(skipped_step.state, CompleteState):
-                py_logger.info(f"Skipping step {skipped_step.name}. Marking as complete.")
-                skipped_step.handle_event("complete")
+                py_logger.info("Skipping step %s. Marking as complete.", skipped_step.name)
+                skipped_step.handle_event("complete", start_time)
     
         # Start the incoming step
         current_step = self.steps[step_index]
         if isinstance(current_step.state, RunningState):
             raise ValueError("Step is already running.")
     
-        current_step.handle_event("start")
+        current_step.handle_event("start", start_time)
         self.current_step_index = step_index + 0
     
     def update(self, current_time):
@@ -231,9 +227,10 @@ class ProductionEngine:
         self.REDIS_HOST = "localhost"
         self.REDIS_PORT = "6379"
         self.r = redis.Redis(
-            host=self.REDIS_HOST, port=self.REDIS_PORT, decode_responses=True
+            host=self.REDIS_HOST, port=self.REDIS_PORT, decode_responses=False  # Binary step events
         )
         self.step_sequence = step_sequence
+        self.clock = make_clock()
         self.frame = 0
         self.running = True
         self.messages = []
@@ -243,23 +240,30 @@ class ProductionEngine:
         """Simulates receiving a message from the DCS."""
         while self.r.llen('operation_queue') > 0:
             #step_name = self.r.rpop(self.event_queue)
-            json_str = self.r.rpop('operation_queue')
-            record = json.loads(json_str)
-            step_name = record['step']
-            start_time = datetime.strptime(record['start_time'], '%Y-%m-%d %H:%M:%S')
+            payload = self.r.rpop('operation_queue')
+            event = decode(payload)
+            step_name = event.step
+            start_time = to_datetime(event.start_time)
+            self.clock.advance(start_time)
             message = (step_name, start_time)
             self.messages.append(message)
 
     def update(self):
-        """Update the state of the step sequence."""
-        current_time = datetime.now()
-        self.step_sequence.update(current_time)
+        """Update the state of the step sequence.
 
-        # Process received messages
+        Every time comes from the engine clock or an event's start_time, so steps
+        are timed in DCS time (or event time on replay), never the host's local time.
+        """
+        # Process received messages, bringing the running step up to each event first
         while self.messages:
             step_name, start_time = self.messages.pop(0)
+            self.step_sequence.update(start_time)
             self.step_sequence.start_next_step(step_name, start_time)
 
+        current_time = self.clock.now()
+        if current_time is not None:
+            self.step_sequence.update(current_time)
+
     def render(self):
         """Render the current state of all steps."""
         print(f"Frame {self.frame + 1}")
@@ -285,16 +289,17 @@ class ProductionEngine:
 
 
 
-df = pd.read_csv('batch_routing.csv')
+routings = RoutingRegistry()
+routing = routings.resolve(None)
+if routing is None:
+    raise SystemExit(f"No default routing (rows without production_order_number) in {routings.path}")
 
 
 # Case Study Setup
 # Define the 10 steps with standard durations (in seconds)
 #steps = [Step(f"step {i+1}", standard_duration=10) for i in range(10)]
 
-steps = []
-for _, row in df.iterrows():
-    steps.append(Step(row['step'], row['duration']))
+steps = [Step(name, duration) for name, duration in zip(routing.names, routing.durations)]
 
 """
 # simulates 2nd step as a processing step
@@ -2,17 +2,12 @@ import time
 from datetime import datetime
 import redis
 from abc import ABC, abstractmethod
-import json
-import logging
+from codec import decode, to_datetime
+from engine_logging import get_logger
 import pandas as pd
 
 # Logger Configuration
-py_logger = logging.getLogger("ProductionLogger")
-py_logger.setLevel(logging.INFO)
-py_handler = logging.FileHandler("logfile.log", mode="w")
-py_formatter = logging.Formatter("%(name)s %(asctime)s %(levelname)s %(message)s")
-py_handler.setFormatter(py_formatter)
-py_logger.addHandler(py_handler)
+py_logger = get_logger("ProductionLogger")
 
 
 # Abstract State Base Class
@@ -37,7 +32,7 @@ class PendingState(StepState):
             step.start_time = start_time or datetime.now()
             step.last_update_time = step.start_time
             step.state = RunningState()
-            py_logger.info(f"Step {step.name} started at {step.start_time}.")
+            py_logger.info("Step %s started at %s.", step.name, step.start_time)
 
     def update(self, step, current_time):
         pass  # No updates in PENDING state
@@ -52,8 +47,10 @@ class RunningState(StepState):
             step.end_time = datetime.now()
             step.elapsed_time = (step.end_time - step.start_time).total_seconds()
             step.state = CompleteState()
-            py_logger.info(f"Step {step.name} completed with final stats:")
-            py_logger.info(step.render())
+            py_logger.info(
+                "Step %s completed: elapsed %.2f s, idle %.2f s, active %.2f s, remaining %.2f s, performance %.2f",
+                step.name, step.elapsed_time, step.idle_time, step.active_time, step.remaining_time, step.processing_performance,
+            )
 
     def update(self, step, current_time):
         time_since_last_update = (current_time - step.last_update_time).total_seconds()
@@ -72,7 +69,7 @@ class RunningState(StepState):
         if step.active_time > step.standard_duration and step.is_processing_step == 0:
             step.state = IdleState()
             step.last_idle_time_update = current_time
-            py_logger.info(f"Step {step.name} is now IDLE.")
+            py_logger.info("Step %s is now IDLE.", step.name)
         
         # Mechanism for calculting the step performance if its a processing step
         
@@ -100,12 +97,12 @@ class IdleState(StepState):
         if event == "resume":
             step.state = RunningState()
             step.last_update_time = datetime.now()
-            py_logger.info(f"Step {step.name} resumed.")
+            py_logger.info("Step %s resumed.", step.name)
         elif event == "complete":
             step.end_time = datetime.now()
             step.elapsed_time = (step.end_time - step.start_time).total_seconds()
             step.state = CompleteState()
-            py_logger.info(f"Step {step.name} completed from IDLE state.")
+            py_logger.info("Step %s completed from IDLE state.", step.name)
 
     def update(self, step, current_time):
         time_since_last_update = (current_time - step.last_update_time).total_seconds()
@@ -173,17 +170,17 @@ class Sequence:
         )
 
         if step_index is None:
-            py_logger.warning(f"Step {step_name} not found in sequence.")
+            py_logger.warning("Step %s not found in sequence.", step_name)
             return
 
         if step_index < self.current_step_index:
-            py_logger.warning(f"Step {step_name} is already completed.")
+            py_logger.warning("Step %s is already completed.", step_name)
             return
 
         for i in range(self.current_step_index, step_index):
             skipped_step = self.steps[i]
             if not isinstance(skipped_step.state, CompleteState):
-                py_logger.info(f"Skipping step {skipped_step.name}. Marking as complete.")
+                py_logger.info("Skipping step %s. Marking as complete.", skipped_step.name)
                 skipped_step.handle_event("complete")
 
         current_step = self.steps[step_index]
@@ -203,17 +200,17 @@ class Sequence:
 class ProductionEngine:
     """ Production Engine """
     def __init__(self, step_sequence):
-        self.redis_client = redis.Redis(host="localhost", port=6379, decode_responses=True)
+        self.redis_client = redis.Redis(host="localhost", port=6379, decode_responses=False)  # Binary step events
         self.step_sequence = step_sequence
         self.messages = []
         self.frame = 0
 
     def process_input(self):
         while self.redis_client.llen("operation_queue") > 0:
-            json_str = self.redis_client.rpop("operation_queue")
-            record = json.loads(json_str)
-            step_name = record["step"]
-            start_time = datetime.strptime(record["start_time"], "%Y-%m-%d %H:%M:%S")
+            payload = self.redis_client.rpop("operation_queue")
+            event = decode(payload)
+            step_name = event.step
+            start_time = to_datetime(event.start_time)
             self.messages.append((step_name, start_time))
 
     def update(self):
@@ -1,24 +1,53 @@
+import asyncio
+import json
+import os
+import signal
+import sys
+import threading
 import time
-from datetime import datetime
+from collections import deque
+from datetime import datetime, timedelta
+from functools import partial
 import redis
 from abc import ABC, abstractmethod
-import json
-import logging
-import pandas as pd
+from codec import decode, decode_many, to_datetimes
+from engine_logging import get_logger
+import step_table
+from clock import make_clock
+from renderers import make_renderer
+import snapshot
+from kpis import make_publisher
+from kpi_history import KpiHistory
+from routing import RoutingRegistry
+from assets import AssetTree
+from dispatcher import Dispatcher
+from telemetry import IdleRules, TelemetryStore
+from step_table import StepTable, table_column
+from transport import make_consumer
+
+# Frame loop settings
+FRAME_INTERVAL = 2.0  # Longest a frame waits for input while operation_queue is idle (seconds)
+INGEST_BATCH = 1000   # Messages pulled per Redis command
+INGEST_BUDGET = 0.5   # Most time a frame spends draining a backlog (seconds)
+ENGINE_MODE = os.getenv("ENGINE_MODE", "frames")  # "frames" (fixed frame loop) or "async" (event-driven loop)
+INBOX_SIZE = 16  # Decoded batches the async reader may hold before it waits for the engine
+TELEMETRY_QUEUE = os.getenv("TELEMETRY_QUEUE", "telemetry_queue")  # Machine messages ("" to turn off)
+STEP_STORE = os.getenv("STEP_STORE", "objects")  # "objects" (a Step object each) or "table" (rows of a StepTable)
+RETIRED_MEMORY = 10000  # Retired batches remembered, so late events cannot bring them back
+# Seconds the last step of a routing may run past its standard_duration before the
+# batch is taken as finished, when no next batch has started on the unit by then
+BATCH_END_GRACE = float(os.getenv("BATCH_END_GRACE", 3600))
 
 # Logger Configuration
-py_logger = logging.getLogger("ProductionLogger")
-py_logger.setLevel(logging.INFO)
-py_handler = logging.FileHandler("logfile.log", mode="w")
-py_formatter = logging.Formatter("%(name)s %(asctime)s %(levelname)s %(message)s")
-py_handler.setFormatter(py_formatter)
-py_logger.addHandler(py_handler)
+py_logger = get_logger("ProductionLogger")
 
 
-# Abstract State Base Class
+# Abstract State Base Class.
+# States hold no data of their own: each one is a single shared instance (PENDING,
+# RUNNING, IDLE, COMPLETE below) and a step's state is checked by identity.
 class StepState(ABC):
     @abstractmethod
-    def handle_event(self, step, event, start_time=None):
+    def handle_event(self, step, event, event_time=None):
         pass
 
     @abstractmethod
@@ -32,12 +61,19 @@ class StepState(ABC):
 
 # State Classes
 class PendingState(StepState):
-    def handle_event(self, step, event, start_time=None):
+    name = "PENDING"
+
+    def handle_event(self, step, event, event_time=None):
         if event == "start":
-            step.start_time = start_time or datetime.now()
+            step.start_time = event_time or datetime.now()
             step.last_update_time = step.start_time
-            step.state = RunningState()
-            py_logger.info(f"Step {step.name} started at {step.start_time}.")
+            step.transition(RUNNING)
+            py_logger.info("Step %s started at %s.", step.name, step.start_time)
+        elif event == "complete":
+            # Skipped over without ever starting
+            step.end_time = event_time or datetime.now()
+            step.transition(COMPLETE)
+            py_logger.info("Step %s skipped. Marking as complete.", step.name)
 
     def update(self, step, current_time):
         pass  # No updates in PENDING state
@@ -46,14 +82,30 @@ class PendingState(StepState):
         return f"Step {step.name}: State = PENDING"
 
 
+# Function to settle a step's times at completion. event_time is when the next
+# step started, so the times are calculated retrospectively up to that point.
+def finalize_times(step, event_time=None):
+    step.end_time = event_time or datetime.now()
+    step.elapsed_time = (step.end_time - step.start_time).total_seconds()
+    step.active_time = step.elapsed_time - step.idle_time
+    step.remaining_time = max(0, step.standard_duration - step.active_time)
+
+
 class RunningState(StepState):
-    def handle_event(self, step, event, start_time=None):
+    name = "RUNNING"
+
+    def handle_event(self, step, event, event_time=None):
         if event == "complete":
-            step.end_time = datetime.now()
-            step.elapsed_time = (step.end_time - step.start_time).total_seconds()
-            step.state = CompleteState()
-            py_logger.info(f"Step {step.name} completed with final stats:")
-            py_logger.info(step.render())
+            finalize_times(step, event_time)
+            step.transition(COMPLETE)
+            py_logger.info(
+                "Step %s completed: elapsed %.2f s, idle %.2f s, active %.2f s, remaining %.2f s, performance %.2f",
+                step.name, step.elapsed_time, step.idle_time, step.active_time, step.remaining_time, step.processing_performance,
+            )
+        elif event == "pause":
+            # Machine stopped (telemetry IdleRules); the step is up to date at this point
+            step.transition(IDLE)
+            py_logger.info("Step %s is now IDLE (machine stopped).", step.name)
 
     def update(self, step, current_time):
         time_since_last_update = (current_time - step.last_update_time).total_seconds()
@@ -70,9 +122,8 @@ class RunningState(StepState):
         # Transition to IDLE if active_time exceeds standard_duration
         # and step is not a processing step
         if step.active_time > step.standard_duration and step.is_processing_step == 0:
-            step.state = IdleState()
-            step.last_idle_time_update = current_time
-            py_logger.info(f"Step {step.name} is now IDLE.")
+            step.transition(IDLE)
+            py_logger.info("Step %s is now IDLE.", step.name)
         
         # Mechanism for calculting the step performance if its a processing step
         
@@ -96,16 +147,17 @@ class RunningState(StepState):
 
 
 class IdleState(StepState):
-    def handle_event(self, step, event, start_time=None):
+    name = "IDLE"
+
+    def handle_event(self, step, event, event_time=None):
         if event == "resume":
-            step.state = RunningState()
-            step.last_update_time = datetime.now()
-            py_logger.info(f"Step {step.name} resumed.")
+            step.transition(RUNNING)
+            step.last_update_time = event_time or datetime.now()
+            py_logger.info("Step %s resumed.", step.name)
         elif event == "complete":
-            step.end_time = datetime.now()
-            step.elapsed_time = (step.end_time - step.start_time).total_seconds()
-            step.state = CompleteState()
-            py_logger.info(f"Step {step.name} completed from IDLE state.")
+            finalize_times(step, event_time)
+            step.transition(COMPLETE)
+            py_logger.info("Step %s completed from IDLE state.", step.name)
 
     def update(self, step, current_time):
         time_since_last_update = (current_time - step.last_update_time).total_seconds()
@@ -122,7 +174,9 @@ class IdleState(StepState):
 
 
 class CompleteState(StepState):
-    def handle_event(self, step, event, start_time=None):
+    name = "COMPLETE"
+
+    def handle_event(self, step, event, event_time=None):
         pass  # No events in COMPLETE state
 
     def update(self, step, current_time):
@@ -135,6 +189,13 @@ class CompleteState(StepState):
         )
 
 
+# Shared state instances
+PENDING = PendingState()
+RUNNING = RunningState()
+IDLE = IdleState()
+COMPLETE = CompleteState()
+
+
 # Step Class
 class Step:
     def __init__(self, name, standard_duration, is_processing_step=0):
@@ -148,65 +209,164 @@ class Step:
         self.idle_time = 0
         self.active_time = 0
         self.remaining_time = 0
-        self.state = PendingState()
+        self.state = PENDING
         self.last_update_time = None
+        self.asset = None  # AssetNode the step runs on, if any
+
+    def transition(self, state):
+        """Change state and update the rollups of the step's asset and its ancestors"""
+        old = self.state
+        self.state = state
+        if self.asset is not None:
+            self.asset.transition(old.name, state.name, self)
 
-    def handle_event(self, event, start_time=None):
-        self.state.handle_event(self, event, start_time)
+    def handle_event(self, event, event_time=None):
+        self.state.handle_event(self, event, event_time)
 
     def update(self, current_time):
-        if self.state in [CompleteState(), IdleState()]:
-            return  # Skip update if the step is complete or idle
-    
+        if self.state is COMPLETE or self.state is PENDING:
+            return  # Nothing to accumulate before the start or after completion
+        if current_time <= self.last_update_time:
+            return  # Already accounted up to a later time
+
+        # Split the update at the RUNNING -> IDLE deadline, so time past it counts
+        # as idle however far apart updates are (e.g. between replayed events)
+        deadline = self.next_deadline()
+        if deadline is not None and current_time > deadline:
+            self.state.update(self, deadline)
         self.state.update(self, current_time)
         
+    def next_deadline(self):
+        """Time at which the step changes state by itself (RUNNING -> IDLE), or None"""
+        if self.state is RUNNING and self.is_processing_step == 0:
+            remaining = max(0, self.standard_duration - self.active_time)
+            # IDLE starts once active_time is past standard_duration, so wake just after
+            return self.last_update_time + timedelta(seconds=remaining, milliseconds=1)
+        return None
         
     def render(self):
         return self.state.render(self)
 
 
+# StepTable state codes <-> shared state instances
+STATES = {
+    step_table.PENDING: PENDING,
+    step_table.RUNNING: RUNNING,
+    step_table.IDLE: IDLE,
+    step_table.COMPLETE: COMPLETE,
+}
+STATE_CODES = {state: code for code, state in STATES.items()}
+
+
+# Step backed by a row of a StepTable.
+# Behaves like Step for the state classes, but its timing lives in numpy columns,
+# so the engine advances all of them at once with StepTable.update().
+class TableStep:
+    __slots__ = ("table", "row")
+
+    def __init__(self, table, name, standard_duration, is_processing_step=0):
+        self.table = table
+        self.row = table.add(name, standard_duration, is_processing_step)
+
+    @property
+    def name(self):
+        return self.table.names[self.row]
+
+    start_time = table_column("start_time")
+    end_time = table_column("end_time")
+    last_update_time = table_column("last_update_time")
+    standard_duration = table_column("standard_duration")
+    elapsed_time = table_column("elapsed_time")
+    idle_time = table_column("idle_time")
+    active_time = table_column("active_time")
+    remaining_time = table_column("remaining_time")
+    processing_performance = table_column("processing_performance")
+
+    @property
+    def asset(self):
+        return self.table.assets[self.row]
+
+    @asset.setter
+    def asset(self, asset):
+        self.table.assets[self.row] = asset
+
+    @property
+    def is_processing_step(self):
+        return int(self.table.is_processing_step[self.row])
+
+    @property
+    def state(self):
+        return STATES[self.table.state[self.row]]
+
+    @state.setter
+    def state(self, state):
+        self.table.state[self.row] = STATE_CODES[state]
+
+    def release(self):
+        self.table.release(self.row)
+
+    handle_event = Step.handle_event
+    transition = Step.transition
+    update = Step.update
+    next_deadline = Step.next_deadline
+    render = Step.render
+
+
 # Step Sequence
 class Sequence:
-    def __init__(self, steps):
+    def __init__(self, steps, step_index=None):
         self.steps = steps
         self.current_step_index = 0
+        # Step name -> position, built once (or shared by every Sequence of a
+        # routing). The first step wins if a name repeats.
+        if step_index is None:
+            step_index = {}
+            for i, step in enumerate(steps):
+                step_index.setdefault(step.name, i)
+        self.step_index = step_index
 
     def start_next_step(self, step_name, start_time):
-        step_index = next(
-            (i for i, step in enumerate(self.steps) if step.name == step_name), None
-        )
+        step_index = self.step_index.get(step_name)
     
         if step_index is None:
-            py_logger.warning(f"Step {step_name} not found in sequence.")
+            py_logger.warning("Step %s not found in sequence.", step_name)
             return
     
         if step_index < self.current_step_index:
-            py_logger.warning(f"Step {step_name} is already completed.")
+            py_logger.warning("Step %s is already completed.", step_name)
+            return
+
+        if step_index == self.current_step_index and self.steps[step_index].state is not PENDING:
+            py_logger.warning("Step %s is already started.", step_name)
             return
     
+        # Complete the running step and every step skipped over. Their times are
+        # settled retrospectively at the moment the new step started.
         for i in range(self.current_step_index, step_index):
             skipped_step = self.steps[i]
-            if not isinstance(skipped_step.state, CompleteState):
-                py_logger.info(f"Skipping step {skipped_step.name}. Marking as complete.")
-                skipped_step.handle_event("complete")
-    
-        if self.current_step_index < len(self.steps):
-            # Calculate elapsed times retrospectively for the current step
-            current_step = self.steps[self.current_step_index]
-            if not isinstance(current_step.state, CompleteState):
-                current_step.elapsed_time = (start_time - current_step.start_time).total_seconds()
-                current_step.active_time = current_step.elapsed_time - current_step.idle_time
-                current_step.remaining_time = max(0, current_step.standard_duration - current_step.active_time)
+            if skipped_step.state is not COMPLETE:
+                skipped_step.handle_event("complete", start_time)
     
         # Start the next step
-        current_step = self.steps[step_index]
-        current_step.handle_event("start", start_time)
+        self.steps[step_index].handle_event("start", start_time)
         self.current_step_index = step_index
     
+    def finish(self, end_time):
+        """Complete the running step, e.g. when the next batch starts on the unit"""
+        if self.current_step_index < len(self.steps):
+            step = self.steps[self.current_step_index]
+            if step.state is RUNNING or step.state is IDLE:
+                step.handle_event("complete", end_time)
+
     def update(self, current_time):
         if self.current_step_index < len(self.steps):
             self.steps[self.current_step_index].update(current_time)
 
+    def next_deadline(self):
+        if self.current_step_index < len(self.steps):
+            return self.steps[self.current_step_index].next_deadline()
+        return None
+
     def render(self):
         for step in self.steps:
             print(step.render())
@@ -214,55 +374,469 @@ class Sequence:
 
 # Production Engine
 class ProductionEngine:
-    """ Production Engine """
-    def __init__(self, step_sequence):
-        self.redis_client = redis.Redis(host="localhost", port=6379, decode_responses=True)
-        self.step_sequence = step_sequence
-        self.messages = []
+    """ Production Engine
+
+    Tracks every live batch as its own Sequence, keyed by (site, unit, batch_id).
+    A sequence is created from new_sequence(key) on the first event of a batch and
+    retired when the next batch starts on the same unit, so only live batches, each
+    with one running step, are updated every frame. Events only report step starts,
+    so a batch on its last step is also finished once that step has run for its
+    standard_duration + BATCH_END_GRACE.
+    """
+    def __init__(self, new_sequence, table=None, clock=None, renderer=None):
+        self.redis_client = redis.Redis(host="localhost", port=6379, decode_responses=False)  # Binary step events
+        self.consumer = make_consumer(self.redis_client, "operation_queue")
+        self.new_sequence = new_sequence
+        self.table = table  # StepTable behind the TableSteps of new sequences, if any
+        self.clock = clock or make_clock()
+        self.renderer = renderer or make_renderer()
+        self.kpis = make_publisher(self.redis_client)
+        self.history = KpiHistory()  # Figures of completed steps, see history.query()
+        # Machine messages, routed by topic to the assets they belong to
+        self.telemetry = make_consumer(self.redis_client, TELEMETRY_QUEUE) if TELEMETRY_QUEUE else None
+        self.dispatcher = Dispatcher()
+        self.watched = set()  # Asset paths subscribed to
+        self.telemetry_backlog = False  # Machine messages left waiting by the last frame
+        self.readings = TelemetryStore()  # Points of every machine parameter, see readings.tumbling()/sliding()
+        self.idle_rules = IdleRules(self.readings)
+        self.sequences = {}      # (site, unit, batch_id) -> Sequence of a live batch
+        self.unit_batches = {}   # (site, unit) -> key of the live batch on that unit
+        self.retired = {}        # Keys of recently retired batches, oldest first
+        self.batch_ends = {}     # Key of a batch on its last step -> when it is taken as finished
+        self.offsets = {}        # (site, unit) -> last record id applied
+        self.messages = deque()
+        self.message_ids = []  # Read but not yet acknowledged (stream transport)
+        self.next_snapshot = time.monotonic() + snapshot.SNAPSHOT_INTERVAL
         self.frame = 0
 
-    def process_input(self):
-        while self.redis_client.llen("operation_queue") > 0:
-            json_str = self.redis_client.rpop("operation_queue")
-            record = json.loads(json_str)
-            step_name = record["step"]
-            start_time = datetime.strptime(record["start_time"], "%Y-%m-%d %H:%M:%S")
-            self.messages.append((step_name, start_time))
+    def decode_entries(self, entries):
+        """Decode a read into (key, step_name, start_time, record_id) messages and their message ids.
+
+        Malformed events are logged and dropped; their message ids are still
+        returned, so they are acknowledged with the rest.
+        """
+        # Decode the whole read at once: one numpy pass over the binary headers
+        # and one datetime conversion for every start_time
+        payloads = [payload for _, payload in entries]
+        try:
+            events = decode_many(payloads)
+        except Exception:
+            events = decode_many([payload for payload in payloads if self.is_valid_event(payload)])
+        keys = zip(events.site, events.unit, events.batch_id)
+        messages = list(zip(keys, events.step, to_datetimes(events.start_time), events.id.tolist()))
+        return messages, [message_id for message_id, _ in entries]
+
+    def is_valid_event(self, payload):
+        try:
+            decode(payload)
+            return True
+        except Exception as e:
+            py_logger.warning("Dropping malformed step event %r: %s", payload[:64], e)
+            return False
+
+    def process_input(self, timeout=0):
+        """Drain operation_queue INGEST_BATCH messages per command, for at most INGEST_BUDGET.
+
+        If the queue is empty, block for up to timeout seconds for the first message.
+        """
+        deadline = time.monotonic() + INGEST_BUDGET
+        entries = self.consumer.read(INGEST_BATCH, timeout)
+        while entries:
+            messages, message_ids = self.decode_entries(entries)
+            self.messages.extend(messages)
+            self.message_ids.extend(message_ids)
+
+            if len(entries) < INGEST_BATCH or time.monotonic() >= deadline:
+                break  # Caught up, or the rest of the backlog waits for the next frame
+            entries = self.consumer.read(INGEST_BATCH)
+
+    def decode_telemetry(self, entries):
+        """Decode a read of machine messages into (topic, payload) pairs and their message ids.
+
+        Messages that are not {"topic": str, "payload": {"parameter", "value", ...}}
+        are logged and dropped.
+        """
+        messages = []
+        for _, data in entries:
+            try:
+                message = json.loads(data)
+                topic, payload = message["topic"], message["payload"]
+                if not isinstance(topic, str) or not isinstance(payload, dict) or not {"parameter", "value"} <= payload.keys():
+                    raise ValueError("expected a topic and a payload with parameter and value")
+                messages.append((topic, payload))
+            except Exception as e:
+                py_logger.warning("Dropping malformed machine message: %s", e)
+        return messages, [message_id for message_id, _ in entries]
+
+    def process_telemetry(self):
+        """Drain the telemetry queue INGEST_BATCH messages per command, for at most INGEST_BUDGET.
+
+        Returns True if messages are still waiting because the budget ran out.
+        """
+        if self.telemetry is None:
+            return False
+        deadline = time.monotonic() + INGEST_BUDGET
+        while True:
+            entries = self.telemetry.read(INGEST_BATCH)
+            if entries:
+                self.dispatch_telemetry(*self.decode_telemetry(entries))
+            if len(entries) < INGEST_BATCH:
+                return False
+            if time.monotonic() >= deadline:
+                return True
+
+    def dispatch_telemetry(self, messages, message_ids):
+        for topic, payload in messages:
+            try:
+                self.dispatcher.dispatch(topic, payload)
+            except Exception as e:
+                py_logger.warning("Dropping machine message on %s: %s", topic, e)
+        self.telemetry.ack(message_ids)
+
+    def watch_assets(self, sequence):
+        """Subscribe the assets a batch's steps run on to their machine messages"""
+        for step in sequence.steps:
+            node = step.asset
+            if node is not None and node.path not in self.watched:
+                self.watched.add(node.path)
+                self.dispatcher.subscribe(node.path, partial(self.handle_machine_message, node))
+
+    def handle_machine_message(self, node, topic, payload):
+        """Add the point(s) of a machine message to the machine's telemetry"""
+        now = self.clock.now()
+        self.readings.add(node.path, payload, None if now is None else step_table.to_seconds(now))
+
+    def apply_idle_rules(self, current_time):
+        """Hold running steps IDLE while their machine's telemetry says it is stopped.
+
+        A step held IDLE resumes once no rule holds. Steps IDLE because they ran
+        past standard_duration are left alone.
+        """
+        if not self.idle_rules.rules:
+            return
+        now = step_table.to_seconds(current_time)
+        for sequence in self.sequences.values():
+            if sequence.current_step_index >= len(sequence.steps):
+                continue
+            step = sequence.steps[sequence.current_step_index]
+            if step.asset is None or not (step.state is RUNNING or step.state is IDLE):
+                continue
+            overrun = step.is_processing_step == 0 and step.active_time > step.standard_duration
+            if overrun:
+                continue
+            stopped = self.idle_rules.holds(step.asset.path, now)
+            if stopped and step.state is RUNNING:
+                step.update(current_time)
+                if step.state is RUNNING:  # May have gone IDLE by itself in that update
+                    step.handle_event("pause", current_time)
+            elif not stopped and step.state is IDLE:
+                step.update(current_time)
+                step.handle_event("resume", current_time)
+
+    def get_sequence(self, key, start_time):
+        """Live sequence for key, created on the first event of a new batch.
+
+        Returns None for events of a batch that was already retired.
+        """
+        sequence = self.sequences.get(key)
+        if sequence is not None:
+            return sequence
+        if key in self.retired:
+            py_logger.warning("Batch %s on %s/%s already retired, ignoring late event.", key[2], key[0], key[1])
+            return None
+
+        sequence = self.new_sequence(key)
+        if sequence is None:
+            py_logger.warning("No routing for batch %s on %s/%s, ignoring event.", key[2], key[0], key[1])
+            return None
+
+        # A new batch on the unit means the previous one has finished
+        unit = key[:2]
+        previous = self.unit_batches.get(unit)
+        if previous is not None:
+            self.finish_batch(previous, min(start_time, self.batch_ends.get(previous, start_time)))
+
+        self.sequences[key] = sequence
+        self.unit_batches[unit] = key
+        self.watch_assets(sequence)
+        py_logger.info("Batch %s on %s/%s started at %s.", key[2], key[0], key[1], start_time)
+        return sequence
+
+    def finish_batch(self, key, end_time):
+        """Complete the running step of a batch at end_time and retire the batch"""
+        sequence = self.sequences[key]
+        first = sequence.current_step_index
+        sequence.update(end_time)
+        sequence.finish(end_time)
+        self.record_completed(key, sequence, first)
+        self.kpis.finish(key, sequence)  # The next publish no longer sees a retired batch
+        self.retire(key)
+
+    def track_batch_end(self, key, sequence):
+        """Note when a batch that reached its last step is taken as finished"""
+        if sequence.current_step_index == len(sequence.steps) - 1:
+            last_step = sequence.steps[-1]
+            if last_step.start_time is not None and key not in self.batch_ends:
+                self.batch_ends[key] = last_step.start_time + timedelta(
+                    seconds=float(last_step.standard_duration) + BATCH_END_GRACE)
+
+    def finish_ended_batches(self, current_time):
+        """Finish batches whose last step ran past standard_duration + BATCH_END_GRACE"""
+        for key, end_time in list(self.batch_ends.items()):
+            if end_time <= current_time:
+                py_logger.info("Batch %s on %s/%s reached the end of its routing.", key[2], key[0], key[1])
+                self.finish_batch(key, end_time)
+
+    def record_completed(self, key, sequence, first):
+        """Add steps completed since step index first to the KPI history.
+
+        Steps skipped without ever starting have no figures and are left out.
+        """
+        for step in sequence.steps[first:sequence.current_step_index + 1]:
+            if step.state is COMPLETE and step.start_time is not None:
+                self.history.record(key[0], key[1], step)
+
+    def retire(self, key):
+        sequence = self.sequences.pop(key)
+        self.batch_ends.pop(key, None)
+        if self.table is not None:
+            for step in sequence.steps:
+                step.release()
+        if self.unit_batches.get(key[:2]) == key:
+            del self.unit_batches[key[:2]]
+        self.retired[key] = None
+        if len(self.retired) > RETIRED_MEMORY:
+            del self.retired[next(iter(self.retired))]
+        py_logger.info("Batch %s on %s/%s retired.", key[2], key[0], key[1])
 
     def update(self):
-        current_time = datetime.utcnow()
-        self.step_sequence.update(current_time)
-
         while self.messages:
-            step_name, start_time = self.messages.pop(0)
-            self.step_sequence.start_next_step(step_name, start_time)
+            key, step_name, start_time, record_id = self.messages.popleft()
+            if record_id >= 0:
+                # Skip events already applied before a restart (re-delivered by the stream)
+                if record_id <= self.offsets.get(key[:2], -1):
+                    continue
+                self.offsets[key[:2]] = record_id
+            self.clock.advance(start_time)
+            sequence = self.get_sequence(key, start_time)
+            if sequence is None:
+                continue
+            # Bring the batch up to the event first, so its timing is exact in event time
+            sequence.update(start_time)
+            first = sequence.current_step_index
+            sequence.start_next_step(step_name, start_time)
+            self.record_completed(key, sequence, first)
+            self.track_batch_end(key, sequence)
+
+        current_time = self.clock.now()
+        if current_time is None:
+            return  # Event clock before the first event
+        self.finish_ended_batches(current_time)
+        self.apply_idle_rules(current_time)
+        if self.table is not None:
+            # One vectorized pass over every running and idle step
+            for row in self.table.update(step_table.to_seconds(current_time)):
+                py_logger.info("Step %s is now IDLE.", self.table.names[row])
+                if self.table.assets[row] is not None:
+                    self.table.assets[row].transition("RUNNING", "IDLE", None)
+        else:
+            for sequence in self.sequences.values():
+                sequence.update(current_time)
+
+    def checkpoint(self):
+        """Acknowledge applied messages.
+
+        With snapshots on, messages are only acknowledged once a snapshot includes
+        them, so a restart resumes from the snapshot and the stream re-delivers the
+        rest. Snapshots are taken every SNAPSHOT_INTERVAL seconds.
+        """
+        if snapshot.SNAPSHOT_BACKEND == "none":
+            self.consumer.ack(self.message_ids)
+            self.message_ids = []
+        elif time.monotonic() >= self.next_snapshot:
+            self.save_snapshot()
+
+    def save_snapshot(self):
+        """Snapshot every live batch, then acknowledge the messages it includes"""
+        self.next_snapshot = time.monotonic() + snapshot.SNAPSHOT_INTERVAL
+        if snapshot.SNAPSHOT_BACKEND == "none":
+            return
+        try:
+            data = snapshot.encode_snapshot(self.sequences, self.retired, self.offsets, self.clock.now(), STATE_CODES)
+            snapshot.save_snapshot(self.redis_client, data)
+        except Exception as e:
+            print(f"Error saving engine snapshot: {e}")
+            return
+        self.consumer.ack(self.message_ids)
+        self.message_ids = []
+        py_logger.info("Saved snapshot of %s batches (%s bytes).", len(self.sequences), len(data))
+
+    def restore_snapshot(self):
+        """Rebuild the live batches from the last snapshot, if there is one"""
+        try:
+            data = snapshot.load_snapshot(self.redis_client)
+            if not data:
+                return
+            metadata, rows = snapshot.decode_snapshot(data)
+        except Exception as e:
+            print(f"Error loading engine snapshot, starting without it: {e}")
+            return
+
+        position = 0
+        for site, unit, batch_id, current_step_index, step_count in metadata["batches"]:
+            key = (site, unit, batch_id)
+            sequence = self.new_sequence(key)
+            if sequence is not None and len(sequence.steps) == step_count:
+                snapshot.restore_steps(sequence, current_step_index, rows[position:position + step_count], STATES)
+                for step in sequence.steps:
+                    if step.asset is not None and (step.state is RUNNING or step.state is IDLE):
+                        step.asset.transition("PENDING", step.state.name, step)
+                self.sequences[key] = sequence
+                self.unit_batches[key[:2]] = key
+                self.track_batch_end(key, sequence)
+                self.watch_assets(sequence)
+            else:
+                py_logger.warning("Routing changed since the snapshot, dropping batch %s on %s/%s.", batch_id, site, unit)
+            position += step_count
+
+        self.retired = dict.fromkeys(tuple(key) for key in metadata["retired"])
+        self.offsets = {(site, unit): last_id for site, unit, last_id in metadata["offsets"]}
+        if metadata["clock"] is not None:
+            self.clock.advance(step_table.from_seconds(metadata["clock"]))
+        py_logger.info("Restored %s batches from snapshot.", len(self.sequences))
+
+    def next_deadline(self):
+        """Earliest time any live batch changes state by itself, or None"""
+        deadlines = [deadline for deadline in (sequence.next_deadline() for sequence in self.sequences.values()) if deadline is not None]
+        deadlines.extend(self.batch_ends.values())
+        return min(deadlines, default=None)
 
     def render(self):
-        print(f"Frame {self.frame + 1}")
-        self.step_sequence.render()
-        print("-" * 30)
+        self.renderer.render(self.frame, self.sequences)
 
     def run(self):
         """Production Loop """
-        # 1. Process input data
-        self.process_input()
+        # 1. Process input data. While the queue is idle this blocks for up to
+        # FRAME_INTERVAL, so a new message starts the next frame straight away,
+        # unless machine messages are still waiting from the last frame.
+        self.process_input(timeout=0 if self.telemetry_backlog else FRAME_INTERVAL)
+        self.telemetry_backlog = self.process_telemetry()
         
         # 2. Update 
         self.update()
+        self.kpis.publish(self.sequences)
+
+        # Acknowledge only once applied, so messages read before a crash are delivered again
+        self.checkpoint()
         
-        # 3. Render
+        # 3. Render (changed steps only, rate-limited by the renderer)
         self.render()
         
-        time.sleep(2)
         self.frame += 1
 
+    async def run_async(self):
+        """Event-driven production loop.
+
+        Reader threads block on operation_queue (and the telemetry queue) and hand
+        decoded batches to the loop. The loop sleeps until the first of: a batch arrives, a running step
+        of any live batch reaches its next deadline (e.g. standard_duration running
+        out -> IDLE), or the next render or KPI publish tick (none when those are
+        off). Nothing runs while there is nothing to do.
+        """
+        loop = asyncio.get_running_loop()
+        inbox = asyncio.Queue(maxsize=INBOX_SIZE)
+        stop = threading.Event()
+
+        def read_input(consumer, decode, name):
+            while not stop.is_set():
+                try:
+                    entries = consumer.read(INGEST_BATCH, timeout=FRAME_INTERVAL)
+                    if entries:
+                        # Blocks while the inbox is full, so a backlog stays in Redis
+                        asyncio.run_coroutine_threadsafe(inbox.put((consumer, decode(entries))), loop).result()
+                except Exception as e:
+                    print(f"Error reading {name}: {e}")
+                    stop.wait(FRAME_INTERVAL)
+
+        threading.Thread(target=read_input, args=(self.consumer, self.decode_entries, "operation_queue"),
+                         name="engine-input", daemon=True).start()
+        if self.telemetry is not None:
+            threading.Thread(target=read_input, args=(self.telemetry, self.decode_telemetry, TELEMETRY_QUEUE),
+                             name="engine-telemetry", daemon=True).start()
+        next_render = loop.time()
+        try:
+            while True:
+                wake_times = []
+                if self.renderer.interval is not None:
+                    wake_times.append(next_render)
+                if self.kpis.interval is not None:
+                    wake_times.append(self.kpis.next_publish)  # time.monotonic, as is loop.time
+                # Deadlines are in clock time, so they only wake the loop on a wall clock
+                deadline = self.next_deadline() if self.clock.realtime else None
+                if deadline is not None:
+                    wake_times.append(loop.time() + (deadline - self.clock.now()).total_seconds())
+
+                try:
+                    timeout = max(0.0, min(wake_times) - loop.time()) if wake_times else None
+                    batch = await asyncio.wait_for(inbox.get(), timeout)
+                    while True:
+                        consumer, (messages, message_ids) = batch
+                        if consumer is self.telemetry:
+                            self.dispatch_telemetry(messages, message_ids)
+                        else:
+                            self.messages.extend(messages)
+                            self.message_ids.extend(message_ids)
+                        if inbox.empty():
+                            break
+                        batch = inbox.get_nowait()
+                except asyncio.TimeoutError:
+                    pass
+
+                self.update()
+                self.kpis.publish(self.sequences)
+                self.checkpoint()
+
+                if self.renderer.interval is not None and loop.time() >= next_render:
+                    self.render()
+                    next_render = loop.time() + self.renderer.interval
+                self.frame += 1
+        finally:
+            stop.set()
+
+
+# Routings, reloaded when the routing file changes, and the assets steps run on
+routings = RoutingRegistry()
+assets = AssetTree()
+table = StepTable() if STEP_STORE == "table" else None
+make_step = Step if table is None else partial(TableStep, table)
+
+
+# Function to build fresh Steps for a batch from its routing (None if it has none),
+# each attached to the machine (or work centre) it runs on
+def new_sequence(key):
+    try:
+        routings.refresh()
+    except Exception as e:
+        print(f"Error reloading routings, keeping the loaded ones: {e}")
+    routing = routings.resolve(None if key[2] is None else str(key[2]))
+    if routing is None:
+        return None
+    sequence = Sequence(routing.instantiate(make_step), routing.step_index)
+    for step, machine in zip(sequence.steps, routing.machines):
+        step.asset = assets.locate(key[0], key[1], machine)
+    return sequence
 
-# Load Steps
-df = pd.read_csv("batch_routing.csv")
-steps = [Step(row["step"], row["duration"]) for _, row in df.iterrows()]
-step_sequence = Sequence(steps)
 
 # Start Production
-engine = ProductionEngine(step_sequence)
-while True:
-    engine.run()
\ No newline at end of file
+if __name__ == "__main__":
+    engine = ProductionEngine(new_sequence, table)
+    engine.restore_snapshot()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))  # Stop through the finally below
+    try:
+        if ENGINE_MODE == "async":
+            asyncio.run(engine.run_async())
+        else:
+            while True:
+                engine.run()
+    finally:
+        engine.save_snapshot()
@@ -0,0 +1,241 @@
+import operator
+import os
+import re
+
+import numpy as np
+
+from step_table import to_seconds
+
+# Process telemetry (temperatures, levels, flows) from machine messages:
+#   {"topic": "enterprise/site/area/work_centre/machine",
+#    "payload": {"timestamp": ..., "parameter": ..., "value": ...}}
+# timestamp is epoch seconds or a naive ISO 8601 string in the DCS time zone, like
+# step start_time. A payload may also carry lists of timestamps and values, which
+# are added in one vectorized pass.
+#
+# Points are kept per (asset path, parameter) in numpy column chunks of
+# TELEMETRY_CHUNK times and values, so no Python object is kept per point. Full
+# chunks older than TELEMETRY_RETENTION are dropped. Aggregates (count, min, max,
+# mean, last) over a window, tumbling windows or sliding windows are computed in
+# vectorized passes over the chunks that overlap the window.
+#
+# TELEMETRY_IDLE lists rules such as "max(flow)<=0,last(speed)==0". While any rule
+# holds over the last TELEMETRY_WINDOW seconds on the machine a step runs on, the
+# step is held IDLE; it resumes when none holds any more.
+TELEMETRY_CHUNK = int(os.getenv("TELEMETRY_CHUNK", 4096))  # Points per column chunk
+TELEMETRY_RETENTION = float(os.getenv("TELEMETRY_RETENTION", 3600))  # Seconds of points kept per parameter
+TELEMETRY_WINDOW = float(os.getenv("TELEMETRY_WINDOW", 60))  # Seconds the idle rules look back
+TELEMETRY_IDLE = os.getenv("TELEMETRY_IDLE", "")
+
+AGGREGATES = ("count", "min", "max", "mean", "last")
+OPERATORS = {"<=": operator.le, ">=": operator.ge, "<": operator.lt, ">": operator.gt, "==": operator.eq, "!=": operator.ne}
+RULE = re.compile(r"\s*(min|max|mean|last)\((\w+)\)\s*(<=|>=|==|!=|<|>)\s*([-+.\deE]+)\s*$")
+
+
+# Function to convert one timestamp or a list of them to epoch seconds
+def parse_times(timestamps):
+    times = np.asarray(timestamps)
+    if times.dtype.kind in "UO":  # ISO 8601 strings
+        times = times.astype("datetime64[us]").astype(np.int64) / 1e6
+    return times.astype(np.float64)
+
+
+class Series:
+    """Points of one parameter, in column chunks of times and values"""
+    def __init__(self, chunk_size=TELEMETRY_CHUNK, retention=TELEMETRY_RETENTION):
+        self.chunk_size = chunk_size
+        self.retention = retention
+        self.chunks = []  # Full chunks, oldest first: (first time, last time, times, values)
+        self.times = np.empty(chunk_size)
+        self.values = np.empty(chunk_size)
+        self.size = 0     # Points in the current chunk
+        self.latest = -np.inf
+
+    def add(self, time, value):
+        self.times[self.size] = time
+        self.values[self.size] = value
+        self.size += 1
+        self.latest = max(self.latest, time)
+        if self.size == self.chunk_size:
+            self.seal()
+
+    def extend(self, times, values):
+        """Add many points at once from equal-length arrays"""
+        if len(times) == 0:
+            return
+        self.latest = max(self.latest, float(times.max()))
+        position = 0
+        while position < len(times):
+            count = min(self.chunk_size - self.size, len(times) - position)
+            self.times[self.size:self.size + count] = times[position:position + count]
+            self.values[self.size:self.size + count] = values[position:position + count]
+            self.size += count
+            position += count
+            if self.size == self.chunk_size:
+                self.seal()
+
+    def seal(self):
+        self.chunks.append((self.times.min(), self.times.max(), self.times, self.values))
+        self.times = np.empty(self.chunk_size)
+        self.values = np.empty(self.chunk_size)
+        self.size = 0
+        # Drop full chunks that are entirely past retention
+        cutoff = self.latest - self.retention
+        while self.chunks and self.chunks[0][1] < cutoff:
+            self.chunks.pop(0)
+
+    def columns(self, start, end):
+        """Times and values of the points with start <= time < end (epoch seconds)"""
+        times = [chunk_times for first, last, chunk_times, _ in self.chunks if last >= start and first < end]
+        values = [chunk_values for first, last, _, chunk_values in self.chunks if last >= start and first < end]
+        times.append(self.times[:self.size])
+        values.append(self.values[:self.size])
+        times = np.concatenate(times) if len(times) > 1 else times[0]
+        values = np.concatenate(values) if len(values) > 1 else values[0]
+        inside = (times >= start) & (times < end)
+        return times[inside], values[inside]
+
+
+# Function to aggregate points into count/min/max/mean/last per bucket. buckets holds
+# the bucket number of each point, 0 to n - 1. Empty buckets are NaN (count 0).
+def aggregate_buckets(times, values, buckets, n):
+    # Sort by bucket, then time, so each bucket is one run ending with its last point
+    order = np.lexsort((times, buckets))
+    buckets, values = buckets[order], values[order]
+    count = np.bincount(buckets, minlength=n)
+    result = {aggregate: np.full(n, np.nan) for aggregate in AGGREGATES}
+    result["count"] = count
+    if len(values):
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        filled = buckets[starts]
+        ends = np.r_[starts[1:], len(values)] - 1
+        result["min"][filled] = np.minimum.reduceat(values, starts)
+        result["max"][filled] = np.maximum.reduceat(values, starts)
+        result["mean"][filled] = np.add.reduceat(values, starts) / count[filled]
+        result["last"][filled] = values[ends]
+    return result
+
+
+class TelemetryStore:
+    """Series for every (asset path, parameter) seen"""
+    def __init__(self, chunk_size=TELEMETRY_CHUNK, retention=TELEMETRY_RETENTION):
+        self.chunk_size = chunk_size
+        self.retention = retention
+        self.series = {}  # (path, parameter) -> Series
+
+    def get_series(self, path, parameter):
+        series = self.series.get((path, parameter))
+        if series is None:
+            series = self.series[(path, parameter)] = Series(self.chunk_size, self.retention)
+        return series
+
+    def add(self, path, payload, now=None):
+        """Add the point(s) of one message payload. now (epoch seconds) stands in for a missing timestamp."""
+        series = self.get_series(path, payload["parameter"])
+        value = payload["value"]
+        timestamp = payload.get("timestamp")
+        if isinstance(value, list):
+            values = np.asarray(value, dtype=np.float64)
+            times = np.full(len(values), now, dtype=np.float64) if timestamp is None else parse_times(timestamp)
+            series.extend(times, values)
+        else:
+            series.add(now if timestamp is None else float(parse_times(timestamp)), value)
+
+    def window(self, path, parameter, start, end):
+        """count/min/max/mean/last from start to end (epoch seconds), or None for an unknown parameter"""
+        series = self.series.get((path, parameter))
+        if series is None:
+            return None
+        times, values = series.columns(start, end)
+        if not len(values):
+            return {"count": 0, "min": np.nan, "max": np.nan, "mean": np.nan, "last": np.nan}
+        return {
+            "count": len(values),
+            "min": float(values.min()),
+            "max": float(values.max()),
+            "mean": float(values.mean()),
+            "last": float(values[times.argmax()]),
+        }
+
+    def tumbling(self, path, parameter, start, end, width):
+        """Aggregates of back-to-back windows of width seconds from start to end (naive datetimes).
+
+        Returns a column per aggregate plus "start", the epoch seconds each window
+        starts at, or None for an unknown parameter.
+        """
+        series = self.series.get((path, parameter))
+        if series is None:
+            return None
+        start, end = to_seconds(start), to_seconds(end)
+        n = max(int(np.ceil((end - start) / width)), 1)
+        times, values = series.columns(start, start + n * width)
+        result = aggregate_buckets(times, values, ((times - start) // width).astype(np.int64), n)
+        result["start"] = start + width * np.arange(n)
+        return result
+
+    def sliding(self, path, parameter, start, end, width, step):
+        """Aggregates of windows of width seconds starting every step seconds (width a multiple of step).
+
+        Built from tumbling windows of step seconds, each sliding window combining
+        width / step of them. Same return value as tumbling().
+        """
+        span = int(round(width / step))
+        if span < 1 or abs(span * step - width) > 1e-9:
+            raise ValueError(f"Window width {width} is not a multiple of step {step}")
+        series = self.series.get((path, parameter))
+        if series is None:
+            return None
+        start, end = to_seconds(start), to_seconds(end)
+        n = max(int(np.ceil((end - start) / step)), 1)
+        times, values = series.columns(start, start + (n + span - 1) * step)
+        buckets = aggregate_buckets(times, values, ((times - start) // step).astype(np.int64), n + span - 1)
+
+        def windows(column):
+            return np.lib.stride_tricks.sliding_window_view(column, span)
+
+        with np.errstate(invalid="ignore"):
+            count = windows(buckets["count"]).sum(axis=1)
+            total = windows(np.nan_to_num(buckets["mean"] * buckets["count"])).sum(axis=1)
+            result = {
+                "count": count,
+                "min": np.fmin.reduce(windows(buckets["min"]), axis=1),
+                "max": np.fmax.reduce(windows(buckets["max"]), axis=1),
+                "mean": np.where(count > 0, total / np.maximum(count, 1), np.nan),
+            }
+            # Last point of the latest non-empty bucket of each window
+            filled = np.where(buckets["count"] > 0, np.arange(n + span - 1), -1)
+            latest = np.maximum.accumulate(filled)[span - 1:]
+            result["last"] = np.where(latest >= np.arange(n), buckets["last"][np.maximum(latest, 0)], np.nan)
+        result["start"] = start + step * np.arange(n)
+        return result
+
+
+# Function to parse TELEMETRY_IDLE into (aggregate, parameter, comparison, threshold) rules
+def parse_rules(text=TELEMETRY_IDLE):
+    rules = []
+    for rule in filter(None, (rule.strip() for rule in text.split(","))):
+        match = RULE.match(rule)
+        if match is None:
+            raise ValueError(f"Invalid telemetry rule {rule!r}")
+        aggregate, parameter, comparison, threshold = match.groups()
+        rules.append((aggregate, parameter, OPERATORS[comparison], float(threshold)))
+    return rules
+
+
+class IdleRules:
+    """Decides from its machine's telemetry whether a step should be held IDLE"""
+    def __init__(self, store, rules=None, window=TELEMETRY_WINDOW):
+        self.store = store
+        self.rules = parse_rules() if rules is None else rules
+        self.window = window
+
+    def holds(self, path, now):
+        """True while any rule holds over the window ending at now (epoch seconds).
+
+        A rule on a parameter without points in the window does not hold.
+        """
+        for aggregate, parameter, comparison, threshold in self.rules:
+            result = self.store.window(path, parameter, now - self.window, now)
+            if result is not None and result["count"] and comparison(result[aggregate], threshold):
+                return True
+        return False
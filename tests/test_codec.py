@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import codec
+
+START = codec.to_epoch(datetime(2026, 3, 1, 6, 30, 15))
+
+
+@pytest.mark.parametrize("encoding", ["json", "binary"])
+def test_round_trip(encoding):
+    payload = codec.encode(42, "PlantA", "Unit1", "B-7", "charge", START, codec=encoding)
+    if encoding == "json":
+        payload = payload.encode()
+    assert codec.decode(payload) == codec.StepEvent(42, "PlantA", "Unit1", "B-7", "charge", START)
+
+
+@pytest.mark.parametrize("encoding", ["json", "binary"])
+def test_missing_id_and_batch(encoding):
+    event = codec.decode(codec.encode(None, "PlantA", "Unit1", None, "charge", START, codec=encoding))
+    assert event.id is None
+    assert event.batch_id is None
+
+
+def test_batch_id_type_is_the_same_in_both_encodings():
+    payloads = [codec.encode(1, "PlantA", "Unit1", 7, "charge", START, codec=encoding) for encoding in ("json", "binary")]
+    payloads.append(b'{"id":3,"site":"PlantA","unit":"Unit1","batch_id":7,"step":"heat","start_time":"2026-03-01 06:30:15"}')
+    assert [codec.decode(payload).batch_id for payload in payloads] == ["7", "7", "7"]
+    assert codec.decode_many(payloads).batch_id == ["7", "7", "7"]
+
+
+def test_decode_many_matches_decode():
+    payloads = [
+        codec.encode(i, "PlantA", f"Unit{i % 2}", "B1", f"step{i}", START + i, codec="binary" if i % 3 else "json")
+        for i in range(10)
+    ]
+    columns = codec.decode_many(payloads)
+    for i, payload in enumerate(payloads):
+        event = codec.decode(payload)
+        assert columns.id[i] == event.id
+        assert columns.start_time[i] == event.start_time
+        assert (columns.site[i], columns.unit[i], columns.batch_id[i], columns.step[i]) == event[1:5]
+
+
+def test_unsupported_version_is_reported():
+    payload = bytearray(codec.encode(1, "PlantA", "Unit1", "B1", "charge", START, codec="binary"))
+    payload[0] = 2
+    with pytest.raises(ValueError, match="Unsupported"):
+        codec.decode(bytes(payload))
+    with pytest.raises(ValueError, match="Unsupported"):
+        codec.decode_many([bytes(payload)])
+
+
+def test_to_datetimes():
+    assert codec.to_datetimes([START]) == [datetime(2026, 3, 1, 6, 30, 15)]
+
+
+def test_to_epoch_of_aware_datetimes():
+    aware = datetime(2026, 3, 1, 8, 30, 15, tzinfo=timezone(timedelta(hours=2)))
+    assert codec.to_epoch(aware) == START
+    assert codec.to_epoch(aware.replace(tzinfo=timezone.utc)) == START + 7200
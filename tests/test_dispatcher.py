@@ -0,0 +1,65 @@
+import pytest
+
+from dispatcher import Dispatcher
+
+MACHINE = "enterprise/site1/area1/unit1/mixer"
+
+
+def subscribed(dispatcher, *topic_filters):
+    for topic_filter in topic_filters:
+        dispatcher.subscribe(topic_filter, topic_filter)  # The filter is its own handler
+    return dispatcher
+
+
+@pytest.mark.parametrize("topic_filter, matches", [
+    (MACHINE, True),
+    ("enterprise/site1/area1/unit1/pump", False),
+    ("enterprise/+/area1/+/mixer", True),
+    ("enterprise/+/mixer", False),
+    ("enterprise/site1/#", True),
+    ("enterprise/site1/area1/unit1/mixer/#", True),  # "#" also matches the parent level
+    ("#", True),
+    ("+/+/+/+", False),
+])
+def test_wildcards(topic_filter, matches):
+    dispatcher = subscribed(Dispatcher(), topic_filter)
+    assert dispatcher.match(MACHINE) == ((topic_filter,) if matches else ())
+
+
+def test_dollar_topics_need_an_explicit_first_level():
+    dispatcher = subscribed(Dispatcher(), "#", "+/status", "$SYS/#")
+    assert dispatcher.match("$SYS/status") == ("$SYS/#",)
+
+
+def test_handler_subscribed_twice_is_called_once():
+    calls = []
+    dispatcher = Dispatcher()
+    handler = lambda topic, payload: calls.append((topic, payload))
+    dispatcher.subscribe("enterprise/#", handler)
+    dispatcher.subscribe(MACHINE, handler)
+    assert dispatcher.dispatch(MACHINE, {"value": 1}) == 1
+    assert calls == [(MACHINE, {"value": 1})]
+
+
+def test_subscribe_and_unsubscribe_refresh_cached_matches():
+    dispatcher = subscribed(Dispatcher(), "enterprise/#")
+    assert dispatcher.match(MACHINE) == ("enterprise/#",)
+    dispatcher.subscribe(MACHINE, "machine")
+    assert set(dispatcher.match(MACHINE)) == {"enterprise/#", "machine"}
+    dispatcher.unsubscribe(MACHINE, "machine")
+    dispatcher.unsubscribe("enterprise/#", "enterprise/#")
+    assert dispatcher.match(MACHINE) == ()
+    assert dispatcher.root.children == {}  # Empty branches are pruned
+
+
+def test_cache_is_bounded():
+    dispatcher = subscribed(Dispatcher(cache_size=2), "#")
+    for i in range(5):
+        dispatcher.match(f"topic/{i}")
+    assert len(dispatcher.cache) <= 2
+
+
+@pytest.mark.parametrize("topic_filter", ["a/#/b", "a/b#", "a/+b", "a+/c"])
+def test_invalid_filters(topic_filter):
+    with pytest.raises(ValueError):
+        Dispatcher().subscribe(topic_filter, print)
@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from kpi_history import METRICS, KpiHistory, RingBuffer
+
+START = datetime(2026, 3, 1)
+
+
+def completed(name, end_time, elapsed_time, idle_time=0.0):
+    return SimpleNamespace(
+        name=name,
+        end_time=end_time,
+        elapsed_time=elapsed_time,
+        active_time=elapsed_time - idle_time,
+        idle_time=idle_time,
+        processing_performance=1.0,
+    )
+
+
+def values(value):
+    return np.full(len(METRICS), value, dtype=np.float32)
+
+
+def test_ring_buffer_buckets_and_reuses_slots():
+    ring = RingBuffer(60, 3)
+    ring.add(0, values(1))
+    ring.add(30, values(3))
+    ring.add(200, values(5))  # Bucket 3 reuses bucket 0's slot
+    buckets, stats = ring.window(0, 200)
+    assert buckets.tolist() == [3]
+    assert stats[0, 0].tolist() == [1, 5, 5, 5]
+
+
+def test_late_point_does_not_wipe_a_newer_bucket():
+    ring = RingBuffer(60, 3)
+    ring.add(200, values(5))
+    ring.add(10, values(1))  # Bucket 0, same slot as bucket 3
+    buckets, stats = ring.window(0, 200)
+    assert buckets.tolist() == [3]
+    assert stats[0, 0].tolist() == [1, 5, 5, 5]
+    assert ring.dropped == 1
+
+
+def test_query_aggregates_a_window():
+    history = KpiHistory([(60, 10), (3600, 24)])
+    for minute, elapsed_time in enumerate([10.0, 20.0, 30.0]):
+        history.record("PlantA", "Unit1", completed("heat", START + timedelta(minutes=minute), elapsed_time))
+    result = history.query("PlantA", "Unit1", "heat", "elapsed_time", START, START + timedelta(minutes=5))
+    assert result["resolution"] == 60
+    assert [bucket[1] for bucket in result["buckets"]] == [1, 1, 1]
+    assert result["count"] == 3
+    assert result["mean"] == pytest.approx(20.0)
+    assert (result["min"], result["max"]) == (10.0, 30.0)
+
+
+def test_query_picks_the_finest_resolution_still_keeping_start():
+    history = KpiHistory([(60, 10), (3600, 24)])
+    history.record("PlantA", "Unit1", completed("heat", START, 10.0))
+    history.record("PlantA", "Unit1", completed("heat", START + timedelta(hours=1), 20.0))
+    result = history.query("PlantA", "Unit1", "heat", "elapsed_time", START, START + timedelta(hours=5))
+    assert result["resolution"] == 3600  # Minute buckets before START + 51 min are gone
+    assert result["count"] == 2
+    result = history.query("PlantA", "Unit1", "heat", "elapsed_time", START + timedelta(minutes=55), START + timedelta(hours=5))
+    assert result["resolution"] == 60
+    assert result["count"] == 1
+
+
+def test_query_of_an_old_window_uses_a_resolution_that_kept_it():
+    history = KpiHistory([(900, 96), (3600, 168), (86400, 90)])
+    for hour in range(5 * 24):
+        history.record("PlantA", "Unit1", completed("heat", START + timedelta(hours=hour, minutes=30), 10.0))
+    result = history.query("PlantA", "Unit1", "heat", "elapsed_time", START, START + timedelta(hours=8))
+    assert result["resolution"] == 3600
+    assert len(result["buckets"]) == 8  # End excluded, so no ninth bucket
+    assert result["count"] == 8
+
+
+def test_window_excludes_the_bucket_starting_at_end():
+    ring = RingBuffer(60, 10)
+    for time in (0, 60, 120, 180):
+        ring.add(time, values(1))
+    buckets, _ = ring.window(0, 180)
+    assert buckets.tolist() == [0, 1, 2]
+
+
+def test_query_of_unknown_step():
+    assert KpiHistory().query("PlantA", "Unit1", "heat", "elapsed_time", START, START) is None
@@ -0,0 +1,37 @@
+from types import SimpleNamespace
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from kpis import KpiPublisher
+
+
+def step(name, state, elapsed_time=0.0):
+    return SimpleNamespace(
+        name=name,
+        state=SimpleNamespace(name=state),
+        elapsed_time=elapsed_time,
+        active_time=elapsed_time,
+        idle_time=0.0,
+        remaining_time=0.0,
+        processing_performance=1.0,
+    )
+
+
+def test_finish_writes_the_final_state_between_publishes():
+    r = fakeredis.FakeRedis(decode_responses=True)
+    publisher = KpiPublisher(r, interval=3600)
+    sequence = SimpleNamespace(steps=[step("A", "RUNNING", 10.0)], current_step_index=0)
+    key = ("site", "unit", 7)
+    publisher.publish({key: sequence})
+
+    sequence.steps[0] = step("A", "COMPLETE", 25.0)
+    publisher.publish({key: sequence})  # Within the interval, nothing is sent
+    assert r.hget("kpi:site/unit", "A.state") == "RUNNING"
+
+    publisher.finish(key, sequence)
+    kpis = r.hgetall("kpi:site/unit")
+    assert kpis["A.state"] == "COMPLETE"
+    assert kpis["A.elapsed_time"] == "25.0"
+    assert kpis["finished"] == "1"
@@ -0,0 +1,57 @@
+import os
+
+from routing import DEFAULT_KEY, Routing, RoutingRegistry, compile_routings
+
+
+def write(path, text):
+    path.write_text(text)
+    return str(path)
+
+
+def test_legacy_file_is_the_default_routing(tmp_path):
+    registry = RoutingRegistry(write(tmp_path / "routing.csv", "step,duration\ncharge,30\nheat,60\n"))
+    routing = registry.resolve("any order")
+    assert routing.key == DEFAULT_KEY
+    assert routing.names == ("charge", "heat")
+    assert routing.durations == (30.0, 60.0)
+    assert routing.machines == (None, None)
+
+
+def test_orders_use_their_lowest_numeric_routing_id(tmp_path):
+    registry = RoutingRegistry(write(tmp_path / "routing.csv", (
+        "production_order_number,routing_id,step,duration\n"
+        "PO1,10,ten,1\n"
+        "PO1,2,two,1\n"
+        "PO1,b,text,1\n"
+    )))
+    assert registry.resolve("PO1").names == ("two",)
+    assert registry.get("PO1", "10").names == ("ten",)
+
+
+def test_missing_default_routing(tmp_path):
+    registry = RoutingRegistry(write(tmp_path / "routing.csv", "production_order_number,routing_id,step,duration\nPO1,1,a,1\n"))
+    assert registry.resolve("PO2") is None
+
+
+def test_reload_after_change_and_cache(tmp_path):
+    path = write(tmp_path / "routing.csv", "step,duration\ncharge,30\n")
+    assert RoutingRegistry(path).resolve(None).names == ("charge",)
+    assert os.path.exists(path + ".cache")
+
+    registry = RoutingRegistry(path)  # From the cache
+    assert registry.resolve(None).names == ("charge",)
+    write(tmp_path / "routing.csv", "step,duration\ncharge,30\nheat,60\n")
+    os.utime(path, ns=(0, 0))  # Make sure the stamp changes
+    registry.refresh()
+    assert registry.resolve(None).names == ("charge", "heat")
+
+
+def test_repeated_step_names_keep_the_first_index():
+    routing = Routing(DEFAULT_KEY, ("a", "b", "a"), (1.0, 1.0, 1.0), (0, 0, 0), (None, None, None))
+    assert routing.step_index == {"a": 0, "b": 1}
+    assert [step[0] for step in routing.instantiate(lambda *step: step)] == ["a", "b", "a"]
+
+
+def test_compile_routings_reads_optional_columns():
+    compiled = compile_routings("step,duration,is_processing_step,machine\nheat,60,1,reactor\n")
+    assert compiled[DEFAULT_KEY] == (("heat",), (60.0,), (1,), ("reactor",))
@@ -0,0 +1,82 @@
+import importlib
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from step_table import RUNNING, StepTable, to_seconds
+
+START = datetime(2026, 3, 1)
+FIELDS = ("elapsed_time", "active_time", "idle_time", "remaining_time", "processing_performance")
+
+
+@pytest.fixture(scope="module")
+def steps6(tmp_path_factory):
+    # steps6 loads batch_routing.csv and opens its log in the working directory on import
+    directory = tmp_path_factory.mktemp("steps6")
+    (directory / "batch_routing.csv").write_text("step,duration\nA,30\n")
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        return importlib.import_module("steps6")
+    finally:
+        os.chdir(cwd)
+
+
+def at(seconds):
+    return START + timedelta(seconds=seconds)
+
+
+def snapshot(step):
+    values = {field: getattr(step, field) for field in FIELDS}
+    values["state"] = step.state.name
+    values["last_update_time"] = step.last_update_time
+    return values
+
+
+def test_table_steps_match_object_steps(steps6):
+    table = StepTable(capacity=1)  # Grows while the steps are added
+    object_steps = [steps6.Step("A", 30), steps6.Step("B", 60, 1)]
+    table_steps = [steps6.TableStep(table, "A", 30), steps6.TableStep(table, "B", 60, 1)]
+
+    def both(action):
+        action(object_steps)
+        action(table_steps)
+        for object_step, table_step in zip(object_steps, table_steps):
+            expected, actual = snapshot(object_step), snapshot(table_step)
+            assert actual["state"] == expected["state"]
+            assert actual["last_update_time"] == expected["last_update_time"]
+            for field in FIELDS:
+                assert actual[field] == pytest.approx(expected[field], abs=1e-6), field
+
+    def advance(seconds):
+        both(lambda steps: [step.update(at(seconds)) for step in steps] if steps is object_steps
+             else table.update(to_seconds(at(seconds))))
+
+    def event(index, name, seconds):
+        both(lambda steps: steps[index].handle_event(name, at(seconds)))
+
+    event(0, "start", 0)
+    advance(10)
+    advance(5)    # Clock behind the last update: nothing changes
+    advance(45)   # Crosses A's IDLE point at 30 s: the rest counts as idle
+    advance(50)
+    advance(55)   # The engine brings a batch up to each event before applying it
+    event(0, "complete", 55)
+    event(1, "start", 55)
+    advance(100)
+    advance(130)  # B is a processing step past its standard duration
+    event(1, "complete", 140)
+
+    a, b = object_steps
+    assert (a.active_time, a.idle_time) == pytest.approx((30.001, 24.999))
+    assert (b.active_time, b.processing_performance) == pytest.approx((85, 60 / 75))
+
+
+def test_update_before_the_last_update_changes_nothing():
+    table = StepTable()
+    row = table.add("A", 30)
+    table.state[row] = RUNNING
+    table.start_time[row] = table.last_update_time[row] = 1000.0
+    table.update(990.0)
+    assert (table.active_time[row], table.elapsed_time[row], table.last_update_time[row]) == (0, 0, 1000)
@@ -0,0 +1,107 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from telemetry import IdleRules, Series, TelemetryStore, parse_rules, parse_times
+
+EPOCH = datetime(1970, 1, 1)
+TIMES = np.arange(0, 300, 0.5)
+VALUES = np.sin(TIMES)
+
+
+@pytest.fixture
+def store():
+    store = TelemetryStore(chunk_size=64, retention=10000)
+    store.add("mixer", {"parameter": "temp", "timestamp": TIMES.tolist(), "value": VALUES.tolist()})
+    return store
+
+
+def brute_force(start, end):
+    inside = (TIMES >= start) & (TIMES < end)
+    return TIMES[inside], VALUES[inside]
+
+
+def test_parse_times():
+    assert parse_times(90.5) == 90.5
+    assert parse_times("1970-01-01T00:01:30.5") == 90.5
+    assert parse_times(["1970-01-01 00:00:01", "1970-01-01 00:00:02"]).tolist() == [1.0, 2.0]
+
+
+def test_window(store):
+    times, values = brute_force(100, 160)
+    result = store.window("mixer", "temp", 100, 160)
+    assert result["count"] == len(values)
+    assert result["mean"] == pytest.approx(values.mean())
+    assert (result["min"], result["max"], result["last"]) == (values.min(), values.max(), values[-1])
+
+
+def test_window_without_points(store):
+    assert store.window("mixer", "temp", 1000, 2000)["count"] == 0
+    assert store.window("mixer", "flow", 0, 10) is None
+
+
+def test_single_points_and_missing_timestamp():
+    store = TelemetryStore(chunk_size=4)
+    for i in range(10):
+        store.add("pump", {"parameter": "flow", "timestamp": float(i), "value": i * 2})
+    store.add("pump", {"parameter": "flow", "value": 99}, now=20.0)
+    result = store.window("pump", "flow", 0, 30)
+    assert (result["count"], result["last"]) == (11, 99)
+
+
+def test_old_chunks_are_dropped():
+    series = Series(chunk_size=10, retention=50)
+    series.extend(np.arange(200.0), np.ones(200))
+    assert len(series.chunks) <= 7
+    times, _ = series.columns(0, 1000)
+    assert times.min() >= 140 and times.max() == 199
+
+
+def test_tumbling(store):
+    result = store.tumbling("mixer", "temp", EPOCH, EPOCH + timedelta(seconds=100), 10)
+    assert result["start"].tolist() == list(range(0, 100, 10))
+    for i, start in enumerate(range(0, 100, 10)):
+        _, values = brute_force(start, start + 10)
+        assert result["count"][i] == len(values)
+        assert result["mean"][i] == pytest.approx(values.mean())
+        assert (result["min"][i], result["max"][i], result["last"][i]) == (values.min(), values.max(), values[-1])
+
+
+def test_sliding(store):
+    result = store.sliding("mixer", "temp", EPOCH, EPOCH + timedelta(seconds=100), 30, 10)
+    for i, start in enumerate(range(0, 100, 10)):
+        _, values = brute_force(start, start + 30)
+        assert result["count"][i] == len(values)
+        assert result["mean"][i] == pytest.approx(values.mean())
+        assert (result["min"][i], result["max"][i], result["last"][i]) == (values.min(), values.max(), values[-1])
+
+
+def test_sliding_past_the_last_point(store):
+    result = store.sliding("mixer", "temp", EPOCH + timedelta(seconds=290), EPOCH + timedelta(seconds=320), 20, 10)
+    assert result["count"].tolist() == [20, 0, 0]
+    assert result["last"][0] == VALUES[-1]
+    assert np.isnan(result["last"][1:]).all()
+
+
+def test_sliding_width_must_be_a_multiple_of_step(store):
+    with pytest.raises(ValueError):
+        store.sliding("mixer", "temp", EPOCH, EPOCH + timedelta(seconds=100), 25, 10)
+
+
+def test_parse_rules():
+    assert [rule[:2] + rule[3:] for rule in parse_rules("max(flow)<=0, last(speed) == 1.5")] == [
+        ("max", "flow", 0.0), ("last", "speed", 1.5),
+    ]
+    with pytest.raises(ValueError):
+        parse_rules("flow<=0")
+
+
+def test_idle_rules():
+    store = TelemetryStore()
+    store.add("pump", {"parameter": "flow", "timestamp": list(range(100)), "value": [5.0] * 40 + [0.0] * 60})
+    rules = IdleRules(store, parse_rules("max(flow)<=0"), window=30)
+    assert not rules.holds("pump", 50.0)   # Flow in the window
+    assert rules.holds("pump", 100.0)      # No flow for the whole window
+    assert not rules.holds("pump", 500.0)  # No points at all
+    assert not rules.holds("mixer", 100.0)
@@ -0,0 +1,90 @@
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+import transport
+from transport import ListConsumer, StreamConsumer
+
+
+@pytest.fixture
+def r():
+    return fakeredis.FakeRedis()
+
+
+def payloads(messages):
+    return [payload for _, payload in messages]
+
+
+def test_list_consumer_reads_oldest_first(r, monkeypatch):
+    monkeypatch.setattr(transport, "REDIS_TRANSPORT", "list")
+    transport.add_messages(r, "queue", [b"1", b"2", b"3", b"4", b"5"], chunk_size=2)
+    consumer = ListConsumer(r, "queue")
+    assert payloads(consumer.read(3)) == [b"1", b"2", b"3"]
+    assert payloads(consumer.read(3)) == [b"4", b"5"]
+    assert consumer.read(3) == []
+
+
+def test_stream_consumer_acks(r, monkeypatch):
+    monkeypatch.setattr(transport, "REDIS_TRANSPORT", "stream")
+    transport.add_messages(r, "queue", [b"1", b"2", b"3"])
+    consumer = StreamConsumer(r, "queue", consumer="engine-a")
+    messages = consumer.read(10)
+    assert payloads(messages) == [b"1", b"2", b"3"]
+    consumer.ack([message_id for message_id, _ in messages])
+    assert r.xpending("queue", transport.STREAM_GROUP)["pending"] == 0
+
+
+def test_restarted_stream_consumer_rereads_its_pending_entries(r, monkeypatch):
+    monkeypatch.setattr(transport, "REDIS_TRANSPORT", "stream")
+    transport.add_messages(r, "queue", [b"1", b"2"])
+    StreamConsumer(r, "queue", consumer="engine-a").read(10)  # Crashes before acking
+    transport.add_messages(r, "queue", [b"3"])
+
+    restarted = StreamConsumer(r, "queue", consumer="engine-a")
+    assert payloads(restarted.read(10)) == [b"1", b"2"]
+    assert payloads(restarted.read(10)) == [b"3"]
+
+
+def test_pending_entries_are_paged_without_acks(r, monkeypatch):
+    monkeypatch.setattr(transport, "REDIS_TRANSPORT", "stream")
+    transport.add_messages(r, "queue", [b"1", b"2", b"3", b"4", b"5"])
+    StreamConsumer(r, "queue", consumer="engine-a").read(10)  # Crashes before acking
+    transport.add_messages(r, "queue", [b"6"])
+
+    restarted = StreamConsumer(r, "queue", consumer="engine-a")
+    read = []
+    while True:
+        messages = restarted.read(2)  # Acks held back, as while waiting for a snapshot
+        if not messages:
+            break
+        read.extend(payloads(messages))
+    assert read == [b"1", b"2", b"3", b"4", b"5", b"6"]
+
+
+def test_entries_pending_with_a_live_peer_are_left_to_it(r, monkeypatch):
+    monkeypatch.setattr(transport, "REDIS_TRANSPORT", "stream")
+    transport.add_messages(r, "queue", [b"1", b"2"])
+    StreamConsumer(r, "queue", consumer="engine-a").read(10)  # Still processing, not acked yet
+    transport.add_messages(r, "queue", [b"3"])
+
+    peer = StreamConsumer(r, "queue", consumer="engine-b")
+    assert payloads(peer.read(10)) == [b"3"]
+    pending = r.xpending_range("queue", transport.STREAM_GROUP, "-", "+", 10)
+    assert [entry["consumer"] for entry in pending] == [b"engine-a", b"engine-a", b"engine-b"]
+
+
+def test_entries_left_by_a_dead_consumer_are_claimed_once_idle(r, monkeypatch):
+    monkeypatch.setattr(transport, "REDIS_TRANSPORT", "stream")
+    monkeypatch.setattr(transport, "STREAM_CLAIM_IDLE_MS", 20)
+    transport.add_messages(r, "queue", [b"1", b"2", b"3"])
+    StreamConsumer(r, "queue", consumer="old-name").read(10)  # Crashes before acking
+
+    restarted = StreamConsumer(r, "queue", consumer="new-name")
+    assert restarted.read(10) == []
+    time.sleep(0.05)
+    messages = restarted.read(10)
+    assert payloads(messages) == [b"1", b"2", b"3"]
+    restarted.ack([message_id for message_id, _ in messages])
+    assert r.xpending("queue", transport.STREAM_GROUP)["pending"] == 0
@@ -0,0 +1,122 @@
+import os
+import socket
+import time
+
+import redis
+
+# Transport used for operation_queue, shared by the fetcher (producer) and the
+# engines (consumers):
+#   "list"   - LPUSH / RPOP. One consumer, a message is gone once popped.
+#   "stream" - XADD / XREADGROUP / XACK. Several engines share one consumer group,
+#              messages stay pending until acked and are reclaimed after a crash.
+REDIS_TRANSPORT = os.getenv("REDIS_TRANSPORT", "list")
+STREAM_GROUP = os.getenv("STREAM_GROUP", "engine")
+# Must stay the same across restarts, so a restarted engine finds the entries it read
+# but never acked. Set it per engine when several engines run on one host.
+STREAM_CONSUMER = os.getenv("STREAM_CONSUMER", socket.gethostname())
+STREAM_MAXLEN = int(os.getenv("STREAM_MAXLEN", 1000000))  # Approximate cap on entries kept per stream
+READ_COUNT = int(os.getenv("READ_COUNT", 1000))  # Max messages per RPOP / XREADGROUP / XAUTOCLAIM
+STREAM_CLAIM_IDLE_MS = int(os.getenv("STREAM_CLAIM_IDLE_MS", 60000))  # Pending this long means the consumer died
+
+
+# Function to queue messages on a (pipelined) Redis client.
+# Lists get multi-value LPUSHes of at most chunk_size messages; LPUSH inserts its
+# values head-first in argument order, so RPOP consumers still see them oldest first.
+# Streams get one XADD per message, trimmed to about STREAM_MAXLEN entries.
+def add_messages(pipe, key, messages, chunk_size=1000):
+    if REDIS_TRANSPORT == "stream":
+        for message in messages:
+            pipe.xadd(key, {"data": message}, maxlen=STREAM_MAXLEN, approximate=True)
+    else:
+        for start in range(0, len(messages), chunk_size):
+            pipe.lpush(key, *messages[start:start + chunk_size])
+
+
+class ListConsumer:
+    """Pops messages off a Redis list. A popped message is already gone, so ack is a no-op."""
+    def __init__(self, redis_client, key):
+        self.r = redis_client
+        self.key = key
+
+    def read(self, count=READ_COUNT, timeout=0):
+        """Returns up to count (message_id, payload) pairs, oldest first.
+
+        Pops with a single RPOP key count (Redis 6.2+). When the list is empty and
+        timeout > 0, blocks on BRPOP for up to timeout seconds instead.
+        """
+        payloads = self.r.rpop(self.key, count)
+        if not payloads and timeout > 0:
+            popped = self.r.brpop(self.key, timeout=timeout)
+            payloads = [popped[1]] if popped else []
+        return [(None, payload) for payload in payloads or []]
+
+    def ack(self, message_ids):
+        pass
+
+
+class StreamConsumer:
+    """Reads a Redis stream as one consumer of a consumer group.
+
+    Entries stay in the group's pending list until ack() is called, so a crash
+    between read() and ack() loses nothing. On start this consumer re-reads its own
+    pending entries, oldest first, before any new entry: the engine skips events
+    older than the last one it applied per unit, so redelivered entries must come
+    first. Entries pending with other consumers are left to them until they have
+    been idle for STREAM_CLAIM_IDLE_MS, then claimed.
+    """
+    def __init__(self, redis_client, key, group=STREAM_GROUP, consumer=STREAM_CONSUMER):
+        self.r = redis_client
+        self.key = key
+        self.group = group
+        self.consumer = consumer
+        self.pending_from = "0"  # Where the next read of our pending entries starts, None once all are read
+        self.next_claim = 0.0
+        try:
+            self.r.xgroup_create(key, group, id="0", mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def read(self, count=READ_COUNT, timeout=0):
+        """Returns up to count (message_id, payload) pairs, oldest first.
+
+        When nothing is waiting and timeout > 0, blocks for up to timeout seconds.
+        """
+        entries = []
+        if self.pending_from is not None:
+            # Page by the last ID returned: entries read but not acked yet stay at the head
+            response = self.r.xreadgroup(self.group, self.consumer, {self.key: self.pending_from}, count=count)
+            entries = response[0][1] if response else []
+            self.pending_from = entries[-1][0] if len(entries) == count else None
+
+        if not entries and time.monotonic() >= self.next_claim:
+            # Reclaim entries other consumers read but never acked
+            self.next_claim = time.monotonic() + STREAM_CLAIM_IDLE_MS / 1000
+            response = self.r.xautoclaim(self.key, self.group, self.consumer, STREAM_CLAIM_IDLE_MS, count=count)
+            entries = response[1]
+
+        if not entries:
+            block = int(timeout * 1000) if timeout > 0 else None
+            response = self.r.xreadgroup(self.group, self.consumer, {self.key: ">"}, count=count, block=block)
+            entries = response[0][1] if response else []
+
+        messages = []
+        trimmed = []
+        for message_id, fields in entries:
+            if not fields:
+                trimmed.append(message_id)  # Trimmed by MAXLEN while pending, nothing left to process
+            else:
+                messages.append((message_id, fields[b"data"] if b"data" in fields else fields["data"]))
+        self.ack(trimmed)
+        return messages
+
+    def ack(self, message_ids):
+        if message_ids:
+            self.r.xack(self.key, self.group, *message_ids)
+
+
+# Function to create the consumer for the configured transport
+def make_consumer(redis_client, key):
+    if REDIS_TRANSPORT == "stream":
+        return StreamConsumer(redis_client, key)
+    return ListConsumer(redis_client, key)